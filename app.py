@@ -1,18 +1,58 @@
+import os
 import streamlit as st
 from attack_traces import *
 import nxd_detecter as nxd
+from ip_utils import PrefixHierarchy
+from result_cache import ResultCache, cache_key, file_fingerprint, trace_fingerprint
+from checkpoints import CheckpointStore, simulate_with_checkpoints
 from explain import page_hhh_explanation 
 from plot_statistics import plot_statistics
 from algo_explain import algo_explain
 
+ORIGINAL_TRACE = 'new_ip.csv'
+
+# Shared by every session of this server process; NXD_CACHE_DIR adds a persistent layer
+RESULT_CACHE = ResultCache(max_bytes=int(os.environ.get('NXD_CACHE_MB', 512)) * 2 ** 20,
+                           directory=os.environ.get('NXD_CACHE_DIR'),
+                           max_disk_bytes=int(os.environ.get('NXD_CACHE_DISK_MB', 4096)) * 2 ** 20)
+# Warm-up states, so changing only the thresholds does not replay the pre-attack traffic
+CHECKPOINTS = CheckpointStore(directory=os.path.join(os.environ['NXD_CACHE_DIR'], 'checkpoints')
+                              if os.environ.get('NXD_CACHE_DIR') else None,
+                              max_disk_bytes=int(os.environ.get('NXD_CHECKPOINT_DISK_MB', 1024)) * 2 ** 20)
+CHECKPOINT_EVERY = 10000
+
+def cached_attack_dataset(packets_num, botnet_num, shared_subnet, subnet_num, attack_packets_num, nxd_num, legit_volume, seed):
+    """
+    create_attack_dataset through the result cache. Returns the dataset,
+    botnets, subnet and the cache key, which is also the content address of
+    the dataset (it is fully determined by the parameters, seed and input trace).
+    """
+    params = dict(packets_num=packets_num, botnet_num=botnet_num, shared_subnet=shared_subnet, subnet_num=subnet_num,
+                  attack_packets_num=attack_packets_num, nxd_num=nxd_num, legit_volume=legit_volume, seed=seed)
+    key = cache_key('create_attack_dataset', params, file_fingerprint(ORIGINAL_TRACE))
+    return RESULT_CACHE.get_or_compute(key, lambda: create_attack_dataset(**params)) + (key,)
+
 def simulate_ddos_attack(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio,
                     upper_attack_threshold_ratio, lower_attack_threshold_ratio, list_expiry_limit,
-                    aging, k, dataset):
+                    aging, k, dataset, dataset_key=None, seed=0):
+    """
+    Run the detection over `dataset`, cached on the parameters, seed and
+    `dataset_key`: the dataset's content address from cached_attack_dataset,
+    or a hash of its contents when not given.
+    """
+    params = dict(hierarchy_levels=hierarchy_levels, upper_threshold_nxd_ratio=upper_threshold_nxd_ratio,
+                  lower_threshold_nxd_ratio=lower_threshold_nxd_ratio, upper_attack_threshold_ratio=upper_attack_threshold_ratio,
+                  lower_attack_threshold_ratio=lower_attack_threshold_ratio, list_expiry_limit=list_expiry_limit,
+                  aging=aging, k=k)
 
-    list_of_dicts = [row.to_dict() for index, row in dataset.iterrows()]
-    nxd_sim = nxd.simulate_attack(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio,
-                    upper_attack_threshold_ratio, lower_attack_threshold_ratio, list_expiry_limit, aging, k, list_of_dicts)
-    return nxd_sim, list_of_dicts
+    def simulate():
+        sources, legitimate = nxd.encode_trace(dataset)
+        nxd_sim, _, _ = simulate_with_checkpoints(sources, legitimate, CHECKPOINTS, seed=seed, every=CHECKPOINT_EVERY, **params)
+        return nxd_sim
+
+    if dataset_key is None:
+        dataset_key = trace_fingerprint(dataset)
+    return RESULT_CACHE.get_or_compute(cache_key('simulate_ddos_attack', params, dataset_key, seed), simulate), dataset
 
 def page_attack_simulation():
     st.title('Attack Simulation')
@@ -56,20 +96,28 @@ def page_attack_simulation():
             value=2,
             help="The number of Non-Existent Domain (NXD) queries generated during the simulation. These simulate malicious DNS queries."
         )
+        seed = st.number_input(
+            'Random seed',
+            min_value=0, value=0,
+            help="Seed for trace generation and simulation. The same parameters and seed give the same results, which are cached."
+        )
         if st.button('Create'):
             with st.spinner('Processing...'):
-                attack_dataset, botnets, subnet = create_attack_dataset(packets_num, botnet_num, shared_subnet, subnet_num, attacke_packets_num, nxd_num, legit_volume)
+                attack_dataset, botnets, subnet, dataset_key = cached_attack_dataset(packets_num, botnet_num, shared_subnet, subnet_num,
+                                                                                     attacke_packets_num, nxd_num, legit_volume, int(seed))
                 st.session_state['attack_dataset'] = attack_dataset
+                st.session_state['attack_dataset_key'] = dataset_key
+                st.session_state['seed'] = int(seed)
                 st.session_state['botnets'] = botnets
                 st.session_state['subnet'] = subnet
                 st.success('Done!')
 
     if 'attack_dataset' in st.session_state:
         with st.expander("Simulate attack"):
-            hierarchy_levels = st.slider(
-                'Hierarchy Levels', 
-                min_value=1, max_value=4, value=2,
-                help="Specifies the number of levels in the IP prefix hierarchy that the RHHH algorithm uses to analyze and track traffic patterns."
+            prefix_lengths = st.text_input(
+                'Hierarchy Prefix Lengths',
+                value='8,16',
+                help="Comma separated IP prefix lengths (1-32) that make up the hierarchy the RHHH algorithm uses to analyze and track traffic patterns, e.g. 8,16,20,24,32. Each length is one level."
             )
             k = st.number_input(
                 'Space Saving Parameter k', 
@@ -108,11 +156,17 @@ def page_attack_simulation():
             )
 
             if st.button('Simulate Attack'):
-                with st.spinner('Processing...'):
-                    dns_protection, packets = simulate_ddos_attack(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio,
-                    upper_attack_threshold_ratio, lower_attack_threshold_ratio, list_expiry_limit, aging, k, st.session_state['attack_dataset'])
-                    plot_statistics(packets, dns_protection.tp, dns_protection.fp, dns_protection.tn, dns_protection.fn)
-                    st.success('Done!')
+                try:
+                    hierarchy_levels = PrefixHierarchy([length for length in prefix_lengths.split(',') if length.strip()]).lengths
+                except ValueError as e:
+                    st.error(f'Invalid prefix lengths: {e}')
+                else:
+                    with st.spinner('Processing...'):
+                        dns_protection, packets = simulate_ddos_attack(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio,
+                        upper_attack_threshold_ratio, lower_attack_threshold_ratio, list_expiry_limit, aging, k, st.session_state['attack_dataset'],
+                        st.session_state['attack_dataset_key'], st.session_state['seed'])
+                        plot_statistics(packets, dns_protection.tp, dns_protection.fp, dns_protection.tn, dns_protection.fn)
+                        st.success('Done!')
 
 
 # Main function to control the page navigation
@@ -1,71 +1,107 @@
+import os
+import numpy as np
 import pandas as pd
-import random
 import string
+import columnar
+from ip_utils import encode_ips, int_to_ip, prefix_mask
+
+LETTERS = np.array(list(string.ascii_lowercase))
 
 # Load the original dataset
 def load_data(file_path):
+    """
+    A trace by path: a columnar directory (see columnar.convert_csv) is
+    memory-mapped, and so is a CSV whose converted columns are up to date;
+    anything else is parsed with read_csv. Mapped traces have uint32 sources.
+    """
+    if os.path.isdir(file_path):
+        return columnar.load_trace(file_path)
+    if columnar.is_current(file_path):
+        return columnar.load_trace(columnar.columnar_path(file_path))
     return pd.read_csv(file_path)
 
-def generate_random_string(length):
+def generate_random_string(length, rng=None):
     """Generate a random string of a given length."""
-    letters = string.ascii_lowercase
-    return ''.join(random.choice(letters) for i in range(length))
+    rng = np.random.default_rng(rng)
+    return ''.join(LETTERS[rng.integers(0, len(LETTERS), size=length)])
 
-def generate_random_url(domain_length, req_length, tld=".com"):
+def generate_random_url(domain_length, req_length, tld=".com", rng=None):
     """Generate a random URL with the specified domain length and TLD."""
-    domain = generate_random_string(domain_length)
-    req = generate_random_string(req_length)
+    rng = np.random.default_rng(rng)
+    domain = generate_random_string(domain_length, rng)
+    req = generate_random_string(req_length, rng)
     return f"http://{domain}{tld}/{req}"
 
-def generate_nxd_urls(num_urls, domain_length=10, req_length=10):
+def generate_nxd_urls(num_urls, domain_length=10, req_length=10, rng=None):
     """Generate a list of randomized URLs that mimic NXD attacks."""
-    urls = [generate_random_url(domain_length, req_length) for _ in range(num_urls)]
+    rng = np.random.default_rng(rng)
+    urls = [generate_random_url(domain_length, req_length, rng=rng) for _ in range(num_urls)]
     return urls
 
-def generate_botnets(data, botnet_num, shared_subnet, subnet_num):
-    ex_ip = data['Source'].drop_duplicates().to_list()
-    rand_ip = random.sample(ex_ip, subnet_num)
-    ret = []
-    subs = []
-    for sub in rand_ip:
-        sub = sub.split('.')[:shared_subnet]
-        subs.append('.'.join(sub))
-        for __ in range(botnet_num):
-            ip = sub.copy()
-            while len(ip) < 4:
-                ip.append(str(random.randint(0,255)))
-            ret.append('.'.join(ip))
-    return ret, subs
+def generate_botnets(data, botnet_num, shared_subnet, subnet_num, rng=None):
+    """
+    Pick subnet_num existing sources and build botnet_num addresses under each,
+    keeping the first shared_subnet octets. Addresses come back as a uint32 array.
+    """
+    rng = np.random.default_rng(rng)
+    ex_ip = data['Source'].drop_duplicates().to_numpy()
+    rand_ip = ex_ip[rng.choice(len(ex_ip), subnet_num, replace=False)]
+    subs = ['.'.join((ip if isinstance(ip, str) else int_to_ip(int(ip))).split('.')[:shared_subnet]) for ip in rand_ip]
+
+    shared_mask = np.uint32(prefix_mask(shared_subnet - 1)) if shared_subnet else np.uint32(0)
+    hosts = rng.integers(0, 2 ** 32, size=(subnet_num, botnet_num), dtype=np.uint32)
+    ret = (encode_ips(rand_ip)[:, None] & shared_mask) | (hosts & ~shared_mask)
+    return ret.ravel(), subs
 
 
 # Generate attacker records
-def generate_attacker_records(original_data, num_records, attack_range, start, botnet_num, shared_subnet, subnet_num, nxd_num):
-    attacker_data = []
+def generate_attacker_records(original_data, num_records, attack_range, start, botnet_num, shared_subnet, subnet_num, nxd_num, seed=None):
+    """
+    Build all int(num_records * attack_range) attacker rows at once: each takes
+    Time and Destination from a random packet in original_data[start:num_records],
+    a random botnet source and a random botnet NXD name.
+    """
+    rng = np.random.default_rng(seed)
     splitted_data = original_data[start:num_records]
-    record = splitted_data.sample().iloc[0]
-    botnets_addresses, subnet = generate_botnets(original_data, botnet_num, shared_subnet, subnet_num)
-    botnets_nxd = generate_nxd_urls(botnet_num)
-    # botnets = list(zip(botnets_addresses, botnets_nxd))
+    botnets_addresses, subnet = generate_botnets(original_data, botnet_num, shared_subnet, subnet_num, rng)
+    botnets_nxd = generate_nxd_urls(botnet_num, rng=rng)
 
-    for _ in range(int(num_records*attack_range)):
-        source = random.choice(botnets_addresses)
-        fake_name = random.choice(botnets_nxd)
-        record = splitted_data.sample().iloc[0]
-        # fake_name = generate_fake_domain(record['Name'])
-        attacker_record = [record['Time'], source, record['Destination'], fake_name, False]
-        attacker_data.append(attacker_record)
+    attack_num = int(num_records*attack_range)
+    records = rng.integers(0, len(splitted_data), size=attack_num)
+    if original_data['Source'].dtype.kind in 'iu':
+        botnet_sources = botnets_addresses  # a mapped trace: keep sources as uint32
+    else:
+        botnet_sources = np.array([int_to_ip(ip) for ip in botnets_addresses.tolist()], dtype=object)
+    attacker_data = pd.DataFrame({
+        'Time': splitted_data['Time'].to_numpy()[records],
+        'Source': botnet_sources[rng.integers(0, len(botnet_sources), size=attack_num)],
+        'Destination': splitted_data['Destination'].to_numpy()[records],
+        'Name': np.array(botnets_nxd, dtype=object)[rng.integers(0, len(botnets_nxd), size=attack_num)],
+        'Legitimate': np.zeros(attack_num, dtype=bool),
+    })
     return attacker_data, botnets_addresses, subnet
 
 # Combine original data with attacker data
 def combine_data(original_data, attacker_data):
     original_data['Legitimate'] = True
-    attacker_df = pd.DataFrame(attacker_data, columns=['Time', 'Source', 'Destination', 'Name', 'Legitimate'])
+    attacker_df = attacker_data
+    if not isinstance(attacker_df, pd.DataFrame):
+        attacker_df = pd.DataFrame(attacker_data, columns=['Time', 'Source', 'Destination', 'Name', 'Legitimate'])
     combined_data = pd.concat([original_data, attacker_df], ignore_index=True)
     return combined_data
 
-def create_attack_dataset(packets_num, botnet_num, shared_subnet, subnet_num, attack_packets_num, nxd_num, legit_volume):
+def create_attack_dataset(packets_num, botnet_num, shared_subnet, subnet_num, attack_packets_num, nxd_num, legit_volume, seed=None):
     original_data = load_data('new_ip.csv')
-    attacker_data, botnets, subnet = generate_attacker_records(original_data, packets_num, attack_packets_num, int(packets_num * legit_volume), botnet_num, shared_subnet, subnet_num, nxd_num)
+    attacker_data, botnets, subnet = generate_attacker_records(original_data, packets_num, attack_packets_num, int(packets_num * legit_volume), botnet_num, shared_subnet, subnet_num, nxd_num, seed)
     combined_data = combine_data(original_data[:packets_num], attacker_data)
     sorted_dataset = combined_data.sort_values(by='Time')
-    return sorted_dataset, botnets, subnet
+    return sorted_dataset, [int_to_ip(ip) for ip in botnets.tolist()], subnet
+
+def synthetic_attack_dataset(packets_num=10000, attack_volume=3.0, seed=None):
+    """
+    The Streamlit default attack trace that the CLIs fall back on: 2 botnet
+    subnets sharing their first 2 octets with existing sources, 2 hosts and
+    2 NXD names each, attacking from the first 10% of the legitimate packets.
+    """
+    dataset, _, _ = create_attack_dataset(packets_num, 2, 2, 2, attack_volume, 2, 0.1, seed=seed)
+    return dataset
@@ -0,0 +1,379 @@
+import argparse
+import datetime
+import json
+import platform
+import random
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+from attack_traces import generate_botnets, load_data, synthetic_attack_dataset
+from hhh import RHHH, SpaceSaving
+from ip_utils import encode_ips
+from nxd_detecter import PROTECTION_PARAMS, DNSProtection
+
+
+class ScanSpaceSaving:
+    # The original O(k) eviction, kept only as a reference point for the benchmark
+    def __init__(self, k):
+        self.k = k
+        self.counters = Counter()
+
+    def increment(self, item, legitimate=False):
+        if item in self.counters or len(self.counters) < self.k:
+            self.counters[item] += 1
+        else:
+            min_item = min(self.counters, key=self.counters.get)
+            min_counter = self.counters.pop(min_item)
+            self.counters[item] = min_counter + 1
+
+    def decrease(self, aging):
+        # Eager aging as RHHH.decrease used to do it
+        for item in self.counters:
+            self.counters[item] = int(self.counters[item] * aging)
+
+
+def random_flood(n, seed=0):
+    """Uniformly random IPv4 sources, so almost every packet misses the summary."""
+    rng = random.Random(seed)
+    return ['.'.join(str(rng.randint(0, 255)) for _ in range(4)) for _ in range(n)]
+
+
+def time_increments(summary, items):
+    start = time.perf_counter()
+    for item in items:
+        summary.increment(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def bench_space_saving(ks, n, include_scan=False, seed=0):
+    items = random_flood(n, seed)
+    rows = []
+    for k in ks:
+        row = {'k': k, 'stream_summary_ns': time_increments(SpaceSaving(k), items) * 1e9}
+        if include_scan:
+            row['scan_ns'] = time_increments(ScanSpaceSaving(k), items) * 1e9
+        rows.append(row)
+    return rows
+
+
+def check_lazy_aging(aging_factors=(0.5, 0.3, 0.9, 1.0), n=50000, universe=500, seed=0):
+    """
+    Compare lazy epoch aging against eager per-counter truncation. k covers the
+    whole universe so no eviction tie-breaking gets in the way of an exact
+    per-item comparison.
+    """
+    rng = random.Random(seed)
+    for aging in aging_factors:
+        lazy, eager = SpaceSaving(universe), ScanSpaceSaving(universe)
+        for i in range(n):
+            item = int(rng.paretovariate(1.2)) % universe
+            lazy.increment(item)
+            eager.increment(item)
+            if rng.random() < 0.01:
+                lazy.decrease(aging)
+                eager.decrease(aging)
+            if i % 997 == 0 and lazy.get(item) != eager.counters[item]:
+                raise AssertionError(f'aging={aging}: {item} lazy={lazy.get(item)} eager={eager.counters[item]}')
+        if lazy.get_counters() != eager.counters:
+            raise AssertionError(f'aging={aging}: lazy and eager counters differ')
+    return True
+
+
+def attack_packets(packets_num=10000, attack_volume=3.0, seed=0):
+    """The Streamlit default attack trace, as packet dicts with uint32 sources."""
+    dataset = synthetic_attack_dataset(packets_num, attack_volume, seed=seed)
+    sources = encode_ips(dataset['Source']).tolist()
+    return [{'Source': source, 'Legitimate': legit} for source, legit in zip(sources, dataset['Legitimate'])]
+
+
+def run_protection(packets, seed=0, **params):
+    random.seed(seed)
+    dns_protection = DNSProtection(**params)
+    start = time.perf_counter()
+    verdicts = [dns_protection.process_packet(packet) for packet in packets]
+    elapsed = time.perf_counter() - start
+    return dns_protection, verdicts, len(packets) / elapsed
+
+
+def bench_decision_table(packets, refreshes, k=10, hierarchy_levels=2, seed=0):
+    """Throughput of the decision table against the exact path, and how often their verdicts differ."""
+    params = dict(PROTECTION_PARAMS, hierarchy_levels=hierarchy_levels, k=k)
+    exact, exact_verdicts, exact_pps = run_protection(packets, seed, **params)
+    rows = [{'mode': 'exact', 'pps': exact_pps, 'disagreement': 0.0,
+             'tp': exact.tp, 'fp': exact.fp, 'tn': exact.tn, 'fn': exact.fn}]
+    for refresh in refreshes:
+        table, verdicts, pps = run_protection(packets, seed, decision_table=True, table_refresh=refresh, **params)
+        differ = sum(a != b for a, b in zip(exact_verdicts, verdicts))
+        rows.append({'mode': f'table/{refresh}', 'pps': pps, 'disagreement': differ / len(packets),
+                     'tp': table.tp, 'fp': table.fp, 'tn': table.tn, 'fn': table.fn})
+    return rows
+
+
+def bench_update_skipping(packets, multipliers, k=10, hierarchy_levels=2, seed=0):
+    """
+    Throughput against detection quality as V grows past H: RHHH.update alone
+    and the full blocking path, with verdict disagreement against V = H and the
+    share of attack packets let through / legitimate packets blocked.
+    """
+    params = dict(PROTECTION_PARAMS, hierarchy_levels=hierarchy_levels, k=k)
+    sources = [packet['Source'] for packet in packets]
+    rows = []
+    baseline = None
+    for multiplier in multipliers:
+        V = hierarchy_levels * multiplier
+        random.seed(seed)
+        rhhh = RHHH(hierarchy_levels, k, V=V)
+        start = time.perf_counter()
+        for source in sources:
+            rhhh.update(source)
+        update_pps = len(sources) / (time.perf_counter() - start)
+        protection, verdicts, pps = run_protection(packets, seed, V=V, **params)
+        if baseline is None:
+            baseline = verdicts
+        differ = sum(a != b for a, b in zip(baseline, verdicts))
+        rows.append({'V': V, 'update_pps': update_pps, 'pps': pps, 'disagreement': differ / len(packets),
+                     'attack_allowed': protection.fp / max(protection.fp + protection.tn, 1),
+                     'legit_blocked': protection.fn / max(protection.fn + protection.tp, 1),
+                     'tp': protection.tp, 'fp': protection.fp, 'tn': protection.tn, 'fn': protection.fn})
+    return rows
+
+
+SKETCH_PAIRS = (('exact', 'exact'), ('space_saving', 'space_saving'), ('count_min', 'space_saving'),
+                ('count_min', 'exact'))
+
+
+def bench_sketches(packets, pairs=SKETCH_PAIRS, k=10, hierarchy_levels=2, seed=0):
+    """
+    Each (legit, attack) sketch pair on the blocking path: throughput, memory
+    held by the trackers at the end (legit_traffic logs excluded, they are the
+    same for every sketch) and verdict disagreement with exact counting.
+    """
+    params = dict(PROTECTION_PARAMS, hierarchy_levels=hierarchy_levels, k=k)
+    _, reference, _ = run_protection(packets, seed, legit_sketch='exact', attack_sketch='exact', **params)
+    rows = []
+    for legit_sketch, attack_sketch in pairs:
+        protection, verdicts, pps = run_protection(packets, seed, legit_sketch=legit_sketch, attack_sketch=attack_sketch, **params)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        random.seed(seed)
+        measured = DNSProtection(legit_sketch=legit_sketch, attack_sketch=attack_sketch, **params)
+        for packet in packets:
+            measured.process_packet(packet)
+        for hh in measured.rh_legit.hh_algorithms + measured.rh_attack.hh_algorithms:
+            hh.legit_traffic.clear()
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        differ = sum(a != b for a, b in zip(reference, verdicts))
+        rows.append({'legit': legit_sketch, 'attack': attack_sketch, 'pps': pps, 'memory_bytes': memory,
+                     'disagreement': differ / len(packets),
+                     'tp': protection.tp, 'fp': protection.fp, 'tn': protection.tn, 'fn': protection.fn})
+    return rows
+
+
+# Benchmark suite: every path over a matrix of k, hierarchy levels and traffic skew
+
+SUITE_PATHS = ('space_saving_hit', 'space_saving_miss', 'rhhh_update', 'rhhh_output', 'dns_process')
+
+
+def suite_traffic(skew, n, seed=0):
+    """
+    uint32 sources and NXD flags. 'zipf' is legitimate traffic with Zipf-like
+    popularity over the sources of new_ip.csv; 'flood' mixes that traffic 1:3
+    with a uniform botnet flood from generate_botnets.
+    """
+    rng = np.random.default_rng(seed)
+    data = load_data('new_ip.csv')
+    known = encode_ips(data['Source'].drop_duplicates())
+    legit = known[(rng.zipf(1.2, size=n) - 1) % len(known)]
+    if skew == 'zipf':
+        return legit, np.zeros(n, dtype=bool)
+    botnets, _ = generate_botnets(data, 4096, 2, 4, rng)
+    nxd_flags = rng.random(n) < 0.75
+    sources = np.where(nxd_flags, botnets[rng.integers(0, len(botnets), size=n)], legit)
+    return sources, nxd_flags
+
+
+def _suite_setup(path, k, hierarchy_levels, sources, nxd_flags):
+    """Fresh state for one path, and the operation to run for each packet."""
+    if path == 'space_saving_hit':
+        summary = SpaceSaving(k)
+        hot = sources[:k].tolist()
+        for item in hot:
+            summary.increment(item)
+        hot = [item for item in hot if item in summary]
+        items = [hot[i % len(hot)] for i in range(len(sources))]
+        return summary.increment, items
+    if path == 'space_saving_miss':
+        summary = SpaceSaving(k)
+        return summary.increment, np.random.default_rng(1).integers(0, 2 ** 32, size=len(sources)).tolist()
+    if path == 'rhhh_update':
+        return RHHH(hierarchy_levels, k).update, sources.tolist()
+    if path == 'rhhh_output':
+        rhhh = RHHH(hierarchy_levels, k)
+        rhhh.update_batch(sources)
+        # output() is polled, not per packet: a few hundred calls are enough
+        return (lambda _: rhhh.output(0.05)), list(range(min(len(sources), 200)))
+    if path == 'dns_process':
+        dns_protection = DNSProtection(hierarchy_levels=hierarchy_levels, k=k, **PROTECTION_PARAMS)
+        process_query = dns_protection.process_query
+        return (lambda packet: process_query(*packet)), list(zip(sources.tolist(), nxd_flags.tolist()))
+    raise ValueError(f"Unknown benchmark path '{path}'")
+
+
+def bench_path(path, k, hierarchy_levels, sources, nxd_flags, seed=0):
+    """Throughput, per-operation latency percentiles and peak traced memory for one cell of the matrix."""
+    random.seed(seed)
+    op, items = _suite_setup(path, k, hierarchy_levels, sources, nxd_flags)
+    start = time.perf_counter()
+    for item in items:
+        op(item)
+    ops_per_sec = len(items) / (time.perf_counter() - start)
+
+    random.seed(seed)
+    op, items = _suite_setup(path, k, hierarchy_levels, sources, nxd_flags)
+    latencies = np.empty(len(items), dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, item in enumerate(items):
+        begin = clock()
+        op(item)
+        latencies[i] = clock() - begin
+
+    random.seed(seed)
+    tracemalloc.start()
+    op, items = _suite_setup(path, k, hierarchy_levels, sources, nxd_flags)
+    for item in items:
+        op(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p90, p99, p999 = np.percentile(latencies, [50, 90, 99, 99.9])
+    return {'path': path, 'k': k, 'hierarchy_levels': hierarchy_levels, 'ops': len(items),
+            'ops_per_sec': ops_per_sec,
+            'latency_ns': {'p50': p50, 'p90': p90, 'p99': p99, 'p999': p999, 'max': int(latencies.max())},
+            'peak_memory_bytes': peak}
+
+
+def run_suite(ks, hierarchy_levels, skews, packets, paths=SUITE_PATHS, seed=0):
+    results = []
+    for skew in skews:
+        sources, nxd_flags = suite_traffic(skew, packets, seed)
+        for path in paths:
+            # SpaceSaving paths do not depend on the hierarchy
+            levels = hierarchy_levels[:1] if path.startswith('space_saving') else hierarchy_levels
+            for k in ks:
+                for level_count in levels:
+                    result = bench_path(path, k, level_count, sources, nxd_flags, seed)
+                    result['skew'] = skew
+                    results.append(result)
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'machine': platform.machine(), 'packets': packets, 'seed': seed,
+                     'timestamp': datetime.datetime.now().isoformat(timespec='seconds')},
+            'results': results}
+
+
+def compare_suites(baseline, current):
+    """Yield (key, baseline, current) for every matrix cell present in both runs."""
+    def key(result):
+        return result['path'], result['k'], result['hierarchy_levels'], result['skew']
+    baseline_results = {key(result): result for result in baseline['results']}
+    for result in current['results']:
+        if key(result) in baseline_results:
+            yield key(result), baseline_results[key(result)], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the RHHH-based DNS protection')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    space_saving = sub.add_parser('space-saving', help='per-packet cost of SpaceSaving.increment as k grows')
+    space_saving.add_argument('--k', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    space_saving.add_argument('--packets', type=int, default=200000)
+    space_saving.add_argument('--scan', action='store_true', help='also time the original O(k) eviction')
+
+    sub.add_parser('check-aging', help='verify lazy aging against the eager version')
+
+    decision_table = sub.add_parser('decision-table', help='decision table vs. exact path agreement')
+    decision_table.add_argument('--refresh', type=int, nargs='+', default=[1, 150, 1000])
+    decision_table.add_argument('--k', type=int, default=10)
+    decision_table.add_argument('--hierarchy-levels', type=int, default=2)
+    decision_table.add_argument('--packets', type=int, default=10000)
+
+    skipping = sub.add_parser('update-skipping', help='throughput vs. detection quality for V > H')
+    skipping.add_argument('--multipliers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='V as multiples of H')
+    skipping.add_argument('--k', type=int, default=10)
+    skipping.add_argument('--hierarchy-levels', type=int, default=2)
+    skipping.add_argument('--packets', type=int, default=10000)
+
+    sketches = sub.add_parser('sketches', help='memory, throughput and block accuracy per tracker sketch')
+    sketches.add_argument('--pair', nargs=2, action='append', metavar=('LEGIT', 'ATTACK'),
+                          help='legit and attack sketch (space_saving, count_min, exact); repeat for more')
+    sketches.add_argument('--k', type=int, default=10)
+    sketches.add_argument('--hierarchy-levels', type=int, default=2)
+    sketches.add_argument('--packets', type=int, default=10000)
+
+    suite = sub.add_parser('suite', help='matrix benchmark of every hot path, written as JSON')
+    suite.add_argument('--k', type=int, nargs='+', default=[10, 100, 1000])
+    suite.add_argument('--hierarchy-levels', type=int, nargs='+', default=[1, 2, 4])
+    suite.add_argument('--skew', nargs='+', choices=['zipf', 'flood'], default=['zipf', 'flood'])
+    suite.add_argument('--paths', nargs='+', choices=SUITE_PATHS, default=list(SUITE_PATHS))
+    suite.add_argument('--packets', type=int, default=50000)
+    suite.add_argument('--out', default='bench_results.json')
+
+    compare = sub.add_parser('compare', help='compare two suite JSON files')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    args = parser.parse_args()
+
+    if args.command == 'space-saving':
+        for row in bench_space_saving(args.k, args.packets, include_scan=args.scan):
+            line = f"k={row['k']:>7}  stream-summary {row['stream_summary_ns']:8.0f} ns/packet"
+            if 'scan_ns' in row:
+                line += f"  scan {row['scan_ns']:10.0f} ns/packet"
+            print(line)
+    elif args.command == 'check-aging':
+        check_lazy_aging()
+        print('lazy aging matches eager aging')
+    elif args.command == 'decision-table':
+        packets = attack_packets(args.packets)
+        for row in bench_decision_table(packets, args.refresh, args.k, args.hierarchy_levels):
+            print(f"{row['mode']:>12}  {row['pps']:9.0f} pkt/s  disagreement {row['disagreement']:7.2%}  "
+                  f"TP={row['tp']} FP={row['fp']} TN={row['tn']} FN={row['fn']}")
+    elif args.command == 'update-skipping':
+        packets = attack_packets(args.packets)
+        for row in bench_update_skipping(packets, args.multipliers, args.k, args.hierarchy_levels):
+            print(f"V={row['V']:<4} update {row['update_pps']:9.0f} pkt/s  protection {row['pps']:9.0f} pkt/s  "
+                  f"disagreement {row['disagreement']:7.2%}  attack allowed {row['attack_allowed']:7.2%}  "
+                  f"legit blocked {row['legit_blocked']:7.2%}")
+    elif args.command == 'sketches':
+        packets = attack_packets(args.packets)
+        for row in bench_sketches(packets, args.pair or SKETCH_PAIRS, args.k, args.hierarchy_levels):
+            print(f"legit={row['legit']:<12} attack={row['attack']:<12} {row['pps']:9.0f} pkt/s  "
+                  f"{row['memory_bytes'] / 1024:8.1f} KiB  disagreement {row['disagreement']:7.2%}  "
+                  f"TP={row['tp']} FP={row['fp']} TN={row['tn']} FN={row['fn']}")
+    elif args.command == 'suite':
+        report = run_suite(args.k, args.hierarchy_levels, args.skew, args.packets, args.paths)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        for row in report['results']:
+            print(f"{row['path']:>18} {row['skew']:>5} k={row['k']:<6} levels={row['hierarchy_levels']}  "
+                  f"{row['ops_per_sec']:10.0f} ops/s  p50 {row['latency_ns']['p50']:8.0f} ns  "
+                  f"p99 {row['latency_ns']['p99']:8.0f} ns  peak {row['peak_memory_bytes'] / 1024:8.0f} KiB")
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        for (path, k, levels, skew), before, after in compare_suites(baseline, current):
+            print(f"{path:>18} {skew:>5} k={k:<6} levels={levels}  "
+                  f"throughput x{after['ops_per_sec'] / before['ops_per_sec']:5.2f}  "
+                  f"p99 x{after['latency_ns']['p99'] / before['latency_ns']['p99']:5.2f}  "
+                  f"peak memory x{after['peak_memory_bytes'] / max(before['peak_memory_bytes'], 1):5.2f}")
+
+
+if __name__ == "__main__":
+    main()
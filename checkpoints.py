@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+import snapshot
+from nxd_detecter import DNSProtection
+
+# Parameters that shape DNSProtection state while the trace is still all
+# legitimate: with no NXD yet nothing is blocked and the attack state never
+# flips, so the thresholds and attack ratios only matter after the first NXD.
+STATE_PARAMS = ('hierarchy_levels', 'k', 'aging', 'list_expiry_limit', 'V', 'family', 'legit_sketch', 'attack_sketch')
+
+
+def prefix_fingerprints(sources, legitimate, positions):
+    """
+    Hash of the first `position` packets for each of `positions`, so traces
+    sharing a prefix share its checkpoints. Sources and flags feed two running
+    sha256 digests, extended segment by segment, so every position costs one
+    pass over the trace in total.
+    """
+    sources = np.ascontiguousarray(sources)
+    if sources.dtype == object:
+        # 128-bit keys are Python ints; hash their values, not the object pointers
+        sources = np.array([key.to_bytes(16, 'big') for key in sources.tolist()], dtype='S16')
+    legitimate = np.ascontiguousarray(legitimate, dtype=bool)
+    source_digest, legit_digest = hashlib.sha256(), hashlib.sha256()
+    fingerprints = {}
+    start = 0
+    for position in sorted(positions):
+        source_digest.update(sources[start:position])
+        legit_digest.update(legitimate[start:position])
+        fingerprints[position] = hashlib.sha256(source_digest.digest() + legit_digest.digest()).hexdigest()
+        start = position
+    return fingerprints
+
+
+def prefix_fingerprint(sources, legitimate, position):
+    """Hash of the first `position` packets (see prefix_fingerprints)."""
+    return prefix_fingerprints(sources, legitimate, [position])[position]
+
+
+def checkpoint_key(params, seed, fingerprint, position, first_nxd):
+    relevant = params if position > first_nxd else {name: params.get(name) for name in STATE_PARAMS}
+    payload = json.dumps({'params': relevant, 'seed': seed, 'trace': fingerprint, 'position': position},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CheckpointStore:
+    """
+    Captured DNSProtection states (see snapshot.capture) by checkpoint key: the
+    most recent `max_checkpoints` in memory, and all of them under `directory`
+    as snapshot directories when one is given, bounded by `max_disk_bytes`
+    (least recently used removed first).
+    """
+    def __init__(self, directory=None, max_checkpoints=32, max_disk_bytes=None):
+        self.directory = directory
+        self.max_checkpoints = max_checkpoints
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.directory is not None and os.path.isdir(os.path.join(self.directory, key)):
+            path = os.path.join(self.directory, key)
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            os.utime(path)  # pruning drops the least recently used checkpoints
+            arrays = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+                      for name in os.listdir(path) if name.endswith('.npy')}
+            self._remember(key, (meta, arrays))
+            return meta, arrays
+        return None
+
+    def __contains__(self, key):
+        return key in self.entries or (self.directory is not None and os.path.isdir(os.path.join(self.directory, key)))
+
+    def put(self, key, captured):
+        self._remember(key, captured)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            snapshot.write_snapshot(captured, os.path.join(self.directory, key))
+            self._prune_disk()
+
+    def _remember(self, key, captured):
+        self.entries[key] = captured
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_checkpoints:
+            self.entries.popitem(last=False)
+
+    def _prune_disk(self):
+        if self.max_disk_bytes is None:
+            return
+        stats = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+            stats.append((os.stat(path).st_mtime, size, path))
+        stats.sort()
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def checkpoint_positions(length, first_nxd, every=None):
+    """Attack start plus every `every` packets, each a position before which state is captured."""
+    positions = {first_nxd} if 0 < first_nxd < length else set()
+    if every:
+        positions.update(range(every, length, every))
+    return sorted(positions)
+
+
+def simulate_with_checkpoints(sources, legitimate, store, seed=0, every=None, decision_table=False,
+                              table_refresh=1000, **params):
+    """
+    simulate_attack_arrays that resumes from the latest compatible checkpoint
+    in `store` and leaves new ones behind at the attack start (the first NXD)
+    and every `every` packets. Returns the protection, the bool verdict array
+    (True where allowed) and the position it resumed from.
+
+    The global random state that RHHH.update draws from is seeded with `seed`
+    and saved with every checkpoint, so a resumed run matches a full replay.
+    In decision-table mode the table is rebuilt after a resume. A checkpoint
+    only stores the verdicts since the one before it and that one's key; a
+    resume joins the chain back to the start.
+    """
+    sources = np.asarray(sources)
+    legitimate = np.asarray(legitimate, dtype=bool)
+    length = len(sources)
+    nxd_positions = np.flatnonzero(~legitimate)
+    first_nxd = int(nxd_positions[0]) if len(nxd_positions) else length
+    positions = checkpoint_positions(length, first_nxd, every)
+    # The table mode changes verdicts once the attack starts, so it is part of the later keys
+    keyed = dict(params, decision_table=decision_table, table_refresh=table_refresh)
+    keys = {position: checkpoint_key(keyed, seed, fingerprint, position, first_nxd)
+            for position, fingerprint in prefix_fingerprints(sources, legitimate, positions).items()}
+
+    verdicts = np.zeros(length, dtype=bool)
+    start = 0
+    dns_protection = None
+    for position in reversed(positions):
+        resumed = _load_chain(store, keys[position])
+        if resumed is not None:
+            (meta, arrays), earlier = resumed
+            # Learned state from the checkpoint, thresholds from this call
+            dns_protection = snapshot.restore(meta, arrays, decision_table=decision_table, table_refresh=table_refresh,
+                                              **params)
+            random.setstate(_random_state(meta['random_state']))
+            verdicts[:position] = earlier
+            start = position
+            break
+    resumed_from = start
+    if dns_protection is None:
+        random.seed(seed)
+        dns_protection = DNSProtection(decision_table=decision_table, table_refresh=table_refresh, **params)
+
+    process_query = dns_protection.process_query
+    bounds = [position for position in positions if position > start] + [length]
+    sources_list = sources.tolist()
+    nxd_list = (~legitimate).tolist()
+    for end in bounds:
+        for i in range(start, end):
+            verdicts[i] = process_query(sources_list[i], nxd_list[i]) == 'Allow'
+        if end < length and keys[end] not in store:
+            meta, arrays = snapshot.capture(dns_protection)
+            meta['random_state'] = random.getstate()
+            meta['previous'] = keys.get(start)  # None for the segment from the trace start
+            arrays['verdicts'] = verdicts[start:end].copy()
+            store.put(keys[end], (meta, arrays))
+        start = end
+    return dns_protection, verdicts, resumed_from
+
+
+def _load_chain(store, key):
+    # A checkpoint and every verdict before it, joined from its chain of
+    # segments; None when it or any earlier link is missing (e.g. pruned)
+    captured = store.get(key)
+    if captured is None:
+        return None
+    segments = [captured[1]['verdicts']]
+    previous = captured[0]['previous']
+    while previous is not None:
+        link = store.get(previous)
+        if link is None:
+            return None
+        segments.append(link[1]['verdicts'])
+        previous = link[0]['previous']
+    return captured, np.concatenate(segments[::-1])
+
+
+def _random_state(state):
+    # JSON turns the state tuple into nested lists
+    version, internal, gauss = state
+    return version, tuple(internal), gauss
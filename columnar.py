@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from ip_utils import DOTTED_QUAD, encode_ips, int_to_ip
+
+IP_COLUMNS = ('Source', 'Destination')
+SEPARATOR = '\0'  # between the UTF-8 values of a dictionary-encoded column
+
+
+def columnar_path(csv_path):
+    """Where convert_csv puts the columns of a CSV trace: new_ip.csv -> new_ip.columns."""
+    return os.path.splitext(csv_path)[0] + '.columns'
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class _Dictionary:
+    """Codes for the values of a string column, stable across chunks."""
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, values):
+        chunk_codes, uniques = pd.factorize(values)  # missing values get -1
+        lookup = np.array([self.codes.setdefault(value, len(self.codes)) for value in uniques.tolist()] + [-1],
+                          dtype=np.int32)
+        return lookup[chunk_codes]
+
+    def values(self):
+        blob = SEPARATOR.join(map(str, self.codes)).encode('utf-8')
+        return np.frombuffer(blob, dtype=np.uint8)
+
+
+def _is_ipv4(values):
+    if values.dtype.kind in 'iu':  # already encoded, e.g. a trace written from a mapped one
+        return bool(((values >= 0) & (values < 2 ** 32)).all())
+    return bool(values.astype(str).str.fullmatch(DOTTED_QUAD).all())
+
+
+def _legitimate(values):
+    # Same reading as encode_trace: only False (or the string 'False') is attack traffic
+    return ~((values == False) | (values.astype(str) == 'False')).to_numpy(dtype=bool)
+
+
+def convert_csv(csv_path, directory=None, chunksize=1_000_000):
+    """
+    One-time conversion of a CSV trace to a directory of .npy columns plus
+    meta.json: Time as float64, Legitimate as bool, Source and Destination as
+    uint32 (dictionary-encoded like Name if any value is not a dotted quad,
+    e.g. a host name), other numeric columns (Length, No.) in the dtype
+    read_csv gives them, widened if a later chunk needs it, and string
+    columns dictionary-encoded as int32 codes plus a blob of the distinct
+    values. A numeric column that meets a string is dictionary-encoded from
+    then on, rows already written included. A first pass counts the rows;
+    the second writes each chunk straight into the memory-mapped column
+    files, so memory stays at one chunk plus the dictionaries. The directory
+    is filled under a temporary name and renamed into place. Returns the
+    directory.
+    """
+    directory = directory or columnar_path(csv_path)
+    rows = sum(len(chunk) for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=[0]))
+    tmp_path = directory + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    columns = {}  # column -> its .npy file, memory-mapped for writing
+    dictionaries = {}
+    start = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        end = start + len(chunk)
+        for column in chunk.columns:
+            values = chunk[column]
+            if column == 'Time':
+                encoded = values.to_numpy(dtype=np.float64)
+            elif column == 'Legitimate':
+                encoded = _legitimate(values)
+            elif column in IP_COLUMNS and column not in dictionaries and _is_ipv4(values):
+                encoded = encode_ips(values)
+            elif column not in IP_COLUMNS and column not in dictionaries and values.dtype.kind in 'biuf':
+                encoded = values.to_numpy()
+            else:
+                if column not in dictionaries:
+                    dictionaries[column] = _Dictionary()
+                    if column in columns:
+                        columns[column] = _to_dictionary(tmp_path, column, columns[column], start,
+                                                         dictionaries[column], chunksize)
+                encoded = dictionaries[column].encode(values)
+            if column not in columns:
+                path = os.path.join(tmp_path, f'{column}.codes.npy' if column in dictionaries else f'{column}.npy')
+                columns[column] = np.lib.format.open_memmap(path, mode='w+', dtype=encoded.dtype, shape=(rows,))
+            elif column not in dictionaries and np.result_type(columns[column].dtype, encoded.dtype) != columns[column].dtype:
+                # e.g. an int column whose later chunk has a missing value, parsed as float
+                columns[column] = _widen(tmp_path, column, columns[column], start,
+                                         np.result_type(columns[column].dtype, encoded.dtype), chunksize)
+            columns[column][start:end] = encoded
+        start = end
+
+    meta = {'source': _source_stamp(csv_path), 'columns': {}, 'rows': rows}
+    for column, array in columns.items():
+        array.flush()
+        if column in dictionaries:
+            meta['columns'][column] = 'dictionary'
+            np.save(os.path.join(tmp_path, f'{column}.values.npy'), dictionaries[column].values())
+        else:
+            meta['columns'][column] = str(array.dtype)
+    columns.clear()  # unmap before the rename
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_path, directory)
+    return directory
+
+
+def _to_dictionary(tmp_path, column, written_values, written, dictionary, chunksize):
+    # An address or numeric column met a value it cannot hold: re-encode the
+    # rows written so far as dictionary codes, a chunk at a time, and drop the
+    # native file. Addresses go back to dotted quads, numbers to their str().
+    codes = np.lib.format.open_memmap(os.path.join(tmp_path, f'{column}.codes.npy'), mode='w+', dtype=np.int32,
+                                      shape=written_values.shape)
+    to_str = int_to_ip if column in IP_COLUMNS else str
+    for start in range(0, written, chunksize):
+        end = min(start + chunksize, written)
+        codes[start:end] = dictionary.encode(pd.Series([to_str(value) for value in written_values[start:end].tolist()]))
+    del written_values
+    os.remove(os.path.join(tmp_path, f'{column}.npy'))
+    return codes
+
+
+def _widen(tmp_path, column, written_values, written, dtype, chunksize):
+    # Copy the rows written so far into a file of the wider dtype, a chunk at a time
+    path = os.path.join(tmp_path, f'{column}.npy')
+    wide = np.lib.format.open_memmap(path + '.wide', mode='w+', dtype=dtype, shape=written_values.shape)
+    for start in range(0, written, chunksize):
+        end = min(start + chunksize, written)
+        wide[start:end] = written_values[start:end]
+    del written_values
+    os.replace(path + '.wide', path)
+    return wide
+
+
+def is_current(csv_path, directory=None):
+    """Whether the columns of csv_path exist and were converted from its current contents."""
+    directory = directory or columnar_path(csv_path)
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return False
+    return meta['source'] == _source_stamp(csv_path)
+
+
+def load_columns(directory):
+    """
+    The columns written by convert_csv, memory-mapped read-only so every
+    process loading the same trace shares its pages. Dictionary-encoded
+    columns come back as pandas Categoricals over the mapped codes.
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {}
+    for column, encoding in meta['columns'].items():
+        if encoding == 'dictionary':
+            codes = np.load(os.path.join(directory, f'{column}.codes.npy'), mmap_mode='r')
+            blob = np.load(os.path.join(directory, f'{column}.values.npy'))
+            values = blob.tobytes().decode('utf-8').split(SEPARATOR) if len(blob) else []
+            columns[column] = pd.Categorical.from_codes(codes, categories=values)
+        else:
+            columns[column] = np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+    return columns
+
+
+def load_trace(directory):
+    """A trace DataFrame over load_columns, without copying the mapped arrays."""
+    return pd.DataFrame(load_columns(directory), copy=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a CSV DNS trace to memory-mapped .npy columns')
+    parser.add_argument('csv_path')
+    parser.add_argument('--directory', help='output directory; default is the CSV path with a .columns suffix')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    directory = convert_csv(args.csv_path, args.directory, args.chunksize)
+    converted = time.perf_counter() - start
+    start = time.perf_counter()
+    pd.read_csv(args.csv_path)
+    parsed = time.perf_counter() - start
+    start = time.perf_counter()
+    trace = load_trace(directory)
+    loaded = time.perf_counter() - start
+    print(f"{len(trace)} rows -> {directory} in {converted:.2f}s")
+    print(f"load: read_csv {parsed * 1e3:.1f} ms, columns {loaded * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+import argparse
+import asyncio
+import secrets
+import socket
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from ip_utils import encode_ips, ip_to_int
+from nxd_detecter import PROTECTION_PARAMS, DNSProtection
+
+HEADER = struct.Struct('!HHHHHH')  # id, flags, qdcount, ancount, nscount, arcount
+RR_FIXED = struct.Struct('!HHIH')  # type, class, ttl, rdlength
+QR, RD, RA, AA = 0x8000, 0x0100, 0x0080, 0x0400
+OPCODE_MASK = 0x7800
+NOERROR, NXDOMAIN, REFUSED = 0, 3, 5
+TYPE_A, TYPE_OPT, CLASS_IN = 1, 41, 1
+OPTION_ECS = 8  # EDNS Client Subnet (RFC 7871)
+MAX_DATAGRAM = 4096
+
+
+def skip_name(view, offset):
+    """Offset just past the (possibly compressed) domain name starting at `offset`."""
+    while True:
+        length = view[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+def read_name(view, offset):
+    """Decode an uncompressed question name; only used where the name itself matters."""
+    labels = []
+    while view[offset]:
+        length = view[offset]
+        labels.append(bytes(view[offset + 1:offset + 1 + length]).decode('latin-1'))
+        offset += length + 1
+    return '.'.join(labels)
+
+
+def parse_query(view):
+    """
+    Header fields of a query datagram, without copying it: returns
+    (txid, flags, question_end, ecs_source), where question_end is the offset
+    just past the first question and ecs_source the IPv4 address carried in an
+    EDNS Client Subnet option as an int (None if absent). Raises ValueError on
+    a truncated or malformed datagram.
+    """
+    try:
+        txid, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(view)
+        offset = HEADER.size
+        question_end = offset
+        for _ in range(qdcount):
+            offset = skip_name(view, offset) + 4
+            if question_end == HEADER.size:
+                question_end = offset
+        for _ in range(ancount + nscount):
+            offset = skip_name(view, offset)
+            offset += RR_FIXED.size + RR_FIXED.unpack_from(view, offset)[3]
+        ecs_source = None
+        for _ in range(arcount):
+            offset = skip_name(view, offset)
+            rtype, _, _, rdlength = RR_FIXED.unpack_from(view, offset)
+            offset += RR_FIXED.size
+            if rtype == TYPE_OPT:
+                ecs_source = _ecs_source(view[offset:offset + rdlength])
+            offset += rdlength
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Malformed DNS datagram: {e}") from e
+    if question_end > len(view):
+        raise ValueError("Malformed DNS datagram: truncated question")
+    return txid, flags, question_end, ecs_source
+
+
+def _ecs_source(options):
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from('!HH', options, offset)
+        offset += 4
+        if code == OPTION_ECS and length >= 4:
+            family, prefix_len = struct.unpack_from('!HB', options, offset)
+            if family == 1:
+                address = bytes(options[offset + 4:offset + length]).ljust(4, b'\0')
+                return int.from_bytes(address, 'big')
+        offset += length
+    return None
+
+
+def response_rcode(view):
+    return view[3] & 0x0F
+
+
+def build_query(txid, name, ecs_source=None):
+    """An A query for `name`, optionally carrying `ecs_source` (int) as an EDNS Client Subnet /32."""
+    labels = b''.join(bytes([len(label)]) + label for label in (part.encode()[:63] for part in name.split('.')) if label)
+    additional = 1 if ecs_source is not None else 0
+    packet = HEADER.pack(txid, RD, 1, 0, 0, additional) + labels + b'\0' + struct.pack('!HH', TYPE_A, CLASS_IN)
+    if ecs_source is not None:
+        option = struct.pack('!HHHBB', OPTION_ECS, 8, 1, 32, 0) + ecs_source.to_bytes(4, 'big')
+        packet += b'\0' + RR_FIXED.pack(TYPE_OPT, MAX_DATAGRAM, 0, len(option)) + option
+    return packet
+
+
+def build_response(view, flags, question_end, rcode, answer=None):
+    """Answer a query with its header and question echoed back, plus an optional A record."""
+    flags = QR | (flags & (OPCODE_MASK | RD)) | RA | rcode
+    response = bytearray(HEADER.pack(HEADER.unpack_from(view)[0], flags, 1, 1 if answer else 0, 0, 0))
+    response += view[HEADER.size:question_end]
+    if answer:
+        # Name is a pointer to the question at offset 12
+        response += b'\xc0\x0c' + RR_FIXED.pack(TYPE_A, CLASS_IN, 60, 4) + socket.inet_aton(answer)
+    return response
+
+
+def _udp_socket(address):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.bind(address)
+    return sock
+
+
+class DNSFilterProxy:
+    """
+    UDP DNS front-end that puts a DNSProtection in the query path. Queries from
+    blocked sources are answered REFUSED; the rest are forwarded to `upstream`
+    and the RCODE of the answer (NXDOMAIN or not) is fed back into the
+    protection when it arrives, so its trackers learn from real resolutions.
+
+    Datagrams are read into one preallocated buffer and parsed through a
+    memoryview; the transaction id is rewritten in place, so a forwarded query
+    or answer is never copied. Each readable event drains up to `batch_size`
+    datagrams before returning to the event loop.
+
+    With `trust_ecs` the source is taken from the EDNS Client Subnet option
+    when present, for deployments behind another forwarder and for load tests
+    that replay a trace from a single host.
+    """
+    def __init__(self, dns_protection, listen=('127.0.0.1', 5353), upstream=('127.0.0.1', 5354),
+                 batch_size=64, timeout=2.0, trust_ecs=False):
+        self.dns_protection = dns_protection
+        self.listen = listen
+        self.upstream = upstream
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.trust_ecs = trust_ecs
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+        # upstream txid -> (client txid, client address, source, sent at, question section)
+        self.pending = {}
+        self.stats = dict.fromkeys(('received', 'allowed', 'blocked', 'answered', 'nxdomain', 'timeouts', 'malformed',
+                                    'mismatched', 'overloaded'), 0)
+        self.client_sock = None
+        self.upstream_sock = None
+        self._sweeper = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.client_sock = _udp_socket(self.listen)
+        self.upstream_sock = _udp_socket(('0.0.0.0', 0))
+        self.listen = self.client_sock.getsockname()
+        loop.add_reader(self.client_sock.fileno(), self._on_query)
+        loop.add_reader(self.upstream_sock.fileno(), self._on_answer)
+        self._sweeper = asyncio.ensure_future(self._expire_pending())
+        return self
+
+    def close(self):
+        loop = asyncio.get_event_loop()
+        for sock in (self.client_sock, self.upstream_sock):
+            if sock is not None:
+                loop.remove_reader(sock.fileno())
+                sock.close()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+
+    def _on_query(self):
+        sock, view, stats = self.client_sock, self.view, self.stats
+        for _ in range(self.batch_size):
+            try:
+                size, address = sock.recvfrom_into(self.buffer)
+            except BlockingIOError:
+                return
+            stats['received'] += 1
+            query = view[:size]
+            try:
+                txid, flags, question_end, ecs_source = parse_query(query)
+            except ValueError:
+                stats['malformed'] += 1
+                continue
+            source = ecs_source if self.trust_ecs and ecs_source is not None else ip_to_int(address[0])
+            if self.dns_protection.decide(source) == 'Block':
+                stats['blocked'] += 1
+                sock.sendto(build_response(query, flags, question_end, REFUSED), address)
+                continue
+            upstream_id = self._upstream_id()
+            if upstream_id is None:
+                stats['overloaded'] += 1
+                continue  # every id is in flight; the client will retry
+            stats['allowed'] += 1
+            self.pending[upstream_id] = (txid, address, source, time.monotonic(), bytes(query[HEADER.size:question_end]))
+            query[0:2] = upstream_id.to_bytes(2, 'big')
+            self.upstream_sock.sendto(query, self.upstream)
+
+    def _upstream_id(self):
+        # Unpredictable and not in flight, so a spoofed or late answer cannot
+        # be matched to another client's query by guessing the next id
+        if len(self.pending) > 0xFFFF:
+            return None
+        while True:
+            upstream_id = secrets.randbits(16)
+            if upstream_id not in self.pending:
+                return upstream_id
+
+    def _on_answer(self):
+        sock, view, stats = self.upstream_sock, self.view, self.stats
+        for _ in range(self.batch_size):
+            try:
+                size, _ = sock.recvfrom_into(self.buffer)
+            except BlockingIOError:
+                return
+            if size < HEADER.size:
+                stats['malformed'] += 1
+                continue
+            answer = view[:size]
+            upstream_id = int.from_bytes(answer[0:2], 'big')
+            entry = self.pending.get(upstream_id)
+            if entry is None:
+                continue  # late answer for an expired query
+            txid, address, source, _, question = entry
+            if answer[HEADER.size:HEADER.size + len(question)] != question:
+                stats['mismatched'] += 1
+                continue  # not the answer to the query holding this id
+            del self.pending[upstream_id]
+            nxd_flg = response_rcode(answer) == NXDOMAIN
+            stats['answered'] += 1
+            stats['nxdomain'] += nxd_flg
+            self.dns_protection.observe(source, 'Allow', nxd_flg)
+            answer[0:2] = txid.to_bytes(2, 'big')
+            self.client_sock.sendto(answer, address)
+
+    async def _expire_pending(self):
+        while True:
+            await asyncio.sleep(self.timeout)
+            deadline = time.monotonic() - self.timeout
+            expired = [upstream_id for upstream_id, entry in self.pending.items() if entry[3] < deadline]
+            for upstream_id in expired:
+                del self.pending[upstream_id]
+            self.stats['timeouts'] += len(expired)
+
+
+class StandInResolver(asyncio.DatagramProtocol):
+    """
+    Local stand-in for a recursive resolver: names in `known_names` resolve to
+    127.0.0.1, everything else is NXDOMAIN. Good enough to load-test the proxy
+    on one box with a trace whose legitimate names are the known ones.
+    """
+    def __init__(self, known_names):
+        self.known_names = set(known_names)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        view = memoryview(data)
+        try:
+            _, flags, question_end, _ = parse_query(view)
+            name = read_name(view, HEADER.size)
+        except (ValueError, IndexError):
+            return
+        if name in self.known_names:
+            self.transport.sendto(build_response(view, flags | AA, question_end, NOERROR, '127.0.0.1'), address)
+        else:
+            self.transport.sendto(build_response(view, flags | AA, question_end, NXDOMAIN), address)
+
+
+class _LoadClient(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.sent_at = {}
+        self.latencies = []
+        self.rcodes = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    def datagram_received(self, data, address):
+        sent_at = self.sent_at.pop(int.from_bytes(data[0:2], 'big'), None)
+        if sent_at is None:
+            return
+        self.latencies.append(time.perf_counter() - sent_at)
+        self.rcodes.append(data[3] & 0x0F)
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+
+async def load_test(target, sources, names, concurrency=256, timeout=2.0):
+    """
+    Replay (source, name) queries against `target` with at most `concurrency`
+    outstanding, each carrying its trace source as an EDNS Client Subnet.
+    Returns qps, latency percentiles and the RCODE mix of the answers.
+    """
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(_LoadClient, remote_addr=target)
+    client.expected = len(sources)
+    queries = [build_query(i & 0xFFFF, name, source) for i, (source, name) in enumerate(zip(sources, names))]
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        while len(client.sent_at) >= concurrency:
+            await asyncio.sleep(0)
+        client.sent_at[i & 0xFFFF] = time.perf_counter()
+        transport.sendto(query)
+    try:
+        await asyncio.wait_for(client.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    transport.close()
+
+    latencies = np.array(client.latencies) * 1e6
+    rcodes = np.array(client.rcodes, dtype=np.int64)
+    percentiles = np.percentile(latencies, [50, 99, 99.9]) if len(latencies) else [float('nan')] * 3
+    return {'queries': len(queries), 'answered': len(latencies), 'qps': len(latencies) / elapsed,
+            'p50_us': percentiles[0], 'p99_us': percentiles[1], 'p999_us': percentiles[2],
+            'noerror': int((rcodes == NOERROR).sum()), 'nxdomain': int((rcodes == NXDOMAIN).sum()),
+            'refused': int((rcodes == REFUSED).sum())}
+
+
+def trace_queries(dataset):
+    """(sources as ints, names, names that resolve) from a trace with Source, Name and Legitimate columns."""
+    sources = encode_ips(dataset['Source']).tolist()
+    names = dataset['Name'].astype(str).tolist()
+    legitimate = dataset['Legitimate'].astype(bool).to_numpy()
+    return sources, names, set(np.asarray(names, dtype=object)[legitimate])
+
+
+async def run_bench(dataset, protection_params, concurrency, port=0):
+    """Stand-in resolver, proxy and load client in one event loop: direct vs proxied latency."""
+    loop = asyncio.get_running_loop()
+    sources, names, known_names = trace_queries(dataset)
+    resolver_transport, _ = await loop.create_datagram_endpoint(lambda: StandInResolver(known_names),
+                                                                local_addr=('127.0.0.1', port))
+    upstream = resolver_transport.get_extra_info('sockname')
+    proxy = await DNSFilterProxy(DNSProtection(**protection_params), ('127.0.0.1', 0), upstream, trust_ecs=True).start()
+    try:
+        direct = await load_test(upstream, sources, names, concurrency)
+        proxied = await load_test(proxy.listen, sources, names, concurrency)
+    finally:
+        proxy.close()
+        resolver_transport.close()
+    return direct, proxied, proxy
+
+
+def _print_result(label, result):
+    print(f"{label:8} {result['answered']}/{result['queries']} answered, {result['qps']:.0f} qps, "
+          f"p50={result['p50_us']:.0f}us p99={result['p99_us']:.0f}us p99.9={result['p999_us']:.0f}us "
+          f"(NOERROR={result['noerror']} NXDOMAIN={result['nxdomain']} REFUSED={result['refused']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UDP DNS filtering proxy in front of DNSProtection')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    proxy_parser = subparsers.add_parser('proxy', help='run the filtering proxy')
+    proxy_parser.add_argument('--listen', default='127.0.0.1:5353')
+    proxy_parser.add_argument('--upstream', default='127.0.0.1:53')
+    proxy_parser.add_argument('--trust-ecs', action='store_true', help='take the source from EDNS Client Subnet')
+
+    resolver_parser = subparsers.add_parser('resolver', help='run the stand-in resolver')
+    resolver_parser.add_argument('--listen', default='127.0.0.1:5354')
+    resolver_parser.add_argument('--names', help='CSV with a Name column of names that resolve')
+
+    bench_parser = subparsers.add_parser('bench', help='load-test resolver and proxy on one box')
+    bench_parser.add_argument('--trace', help='CSV trace or columnar directory with Source, Name and Legitimate columns; default is synthetic')
+    bench_parser.add_argument('--packets', type=int, default=10000, help='legitimate packets in the synthetic trace')
+    bench_parser.add_argument('--attack-volume', type=float, default=3.0)
+    bench_parser.add_argument('--concurrency', type=int, default=256)
+    bench_parser.add_argument('--seed', type=int, default=0)
+
+    for sub in (proxy_parser, bench_parser):
+        sub.add_argument('--hierarchy-levels', type=int, default=2)
+        sub.add_argument('--k', type=int, default=10)
+        sub.add_argument('--list-expiry-limit', type=int, default=150)
+        sub.add_argument('--aging', type=float, default=0.5)
+    args = parser.parse_args()
+
+    def address(value):
+        host, port = value.rsplit(':', 1)
+        return host, int(port)
+
+    if args.command == 'resolver':
+        known_names = pd.read_csv(args.names, usecols=['Name'])['Name'].astype(str) if args.names else []
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(loop.create_datagram_endpoint(lambda: StandInResolver(known_names),
+                                                              local_addr=address(args.listen)))
+        print(f"Stand-in resolver on {args.listen} ({len(known_names)} known names)")
+        loop.run_forever()
+        return
+
+    protection_params = dict(PROTECTION_PARAMS, hierarchy_levels=args.hierarchy_levels, aging=args.aging, k=args.k,
+                             list_expiry_limit=args.list_expiry_limit)
+
+    if args.command == 'proxy':
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        proxy = DNSFilterProxy(DNSProtection(**protection_params), address(args.listen), address(args.upstream),
+                               trust_ecs=args.trust_ecs)
+        loop.run_until_complete(proxy.start())
+        print(f"Filtering {proxy.listen} -> {args.upstream}")
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            print(proxy.stats)
+        return
+
+    from attack_traces import load_data, synthetic_attack_dataset
+    if args.trace:
+        dataset = load_data(args.trace)
+    else:
+        dataset = synthetic_attack_dataset(args.packets, args.attack_volume, seed=args.seed)
+    direct, proxied, proxy = asyncio.run(run_bench(dataset, protection_params, args.concurrency))
+    _print_result('direct', direct)
+    _print_result('proxied', proxied)
+    print(f"added latency p50={proxied['p50_us'] - direct['p50_us']:.0f}us p99={proxied['p99_us'] - direct['p99_us']:.0f}us")
+    print(proxy.stats)
+    dns_protection = proxy.dns_protection
+    print(f"TP={dns_protection.tp} FP={dns_protection.fp} under attack: {dns_protection.under_attack}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,643 @@
+import heapq
 import random
+import numpy as np
 import pandas as pd
 from collections import defaultdict, Counter
 import math
+from functools import lru_cache
 from scipy.stats import norm
+from ip_utils import PrefixHierarchy
+
+def increment_each(sketch, items, weights, legitimate=False):
+    # increment_many for sketches without a vectorized update
+    for item, weight in zip(np.asarray(items).tolist(), np.asarray(weights).tolist()):
+        sketch.increment(item, legitimate=legitimate, weight=weight)
+
+
+class _Bucket:
+    # One node of the Stream-Summary list: every item in it shares the same count,
+    # valid as of aging epoch `epoch`
+    __slots__ = ('count', 'epoch', 'items', 'prev', 'next')
+
+    def __init__(self, count, epoch):
+        self.count = count
+        self.epoch = epoch
+        self.items = set()
+        self.prev = None
+        self.next = None
+
 
 class SpaceSaving:
+    """
+    Space-Saving on top of a Stream-Summary: counters are grouped in buckets of
+    equal count kept in a linked list sorted by count, so hits, misses and
+    evictions of the minimum are O(1) instead of a scan over all k counters.
+
+    Aging is lazy: decrease() only bumps an epoch, and a bucket replays the
+    missed int(count * aging) steps the next time it is touched. Truncation is
+    monotone, so the list stays sorted; buckets that collapse onto the same
+    count are merged as they are walked over.
+    """
+    name = 'space_saving'
+    enumerable = True
+
     def __init__(self, k):
         self.k = k
-        self.counters = Counter()
         self.min_counter = 0
+        self.evictions = 0
         self.legit_traffic = Counter()  # Add counter for legitimate traffic
+        self.epoch = 0
+        self.aging = None
+        self._index = {}  # item -> bucket
+        self._head = None  # bucket with the smallest count
+        self._total = 0  # sum of all counters; None until recounted after an aging tick
 
-    def increment(self, item, legitimate=False):
+    def increment(self, item, legitimate=False, weight=1):
         if legitimate:
-            self.legit_traffic[item] += 1  # Track legitimate traffic
-        if item in self.counters or len(self.counters) < self.k:
-            self.counters[item] += 1
+            self.legit_traffic[item] += weight  # Track legitimate traffic
+        if self._total is not None:
+            self._total += weight  # a hit, an insert and an eviction all add exactly `weight`
+        bucket = self._index.get(item)
+        if bucket is not None:
+            self._refresh(bucket)
+            bucket.items.remove(item)
+            self._add(item, bucket.count + weight, bucket)
+            if not bucket.items:
+                self._unlink(bucket)
+        elif len(self._index) < self.k:
+            self._add(item, weight, None)
+        else:
+            # Replace an item of the minimal bucket
+            head = self._head
+            self._refresh(head)
+            min_item = head.items.pop()
+            self.min_counter = head.count
+            self.evictions += 1
+            del self._index[min_item]
+            self._add(item, self.min_counter + weight, head)
+            if not head.items:
+                self._unlink(head)
+
+    def increment_many(self, items, weights, legitimate=False):
+        # Distinct items with their weights, e.g. from RHHH.update_batch
+        increment_each(self, items, weights, legitimate)
+
+    def _refresh(self, bucket):
+        # Apply the aging ticks this bucket has missed, stopping at a fixed point
+        # (0, or any count with aging 1.0) instead of walking every missed tick
+        count = bucket.count
+        for _ in range(self.epoch - bucket.epoch):
+            aged = int(count * self.aging)
+            if aged == count:
+                break
+            count = aged
+        bucket.count = count
+        bucket.epoch = self.epoch
+
+    def _add(self, item, count, after):
+        # Place item with the given count, searching forward from `after`
+        # (a refreshed bucket with a smaller count) or from the head when it is None
+        prev = after
+        node = self._head if after is None else after.next
+        while node is not None:
+            self._refresh(node)
+            if prev is not None and node.count == prev.count:
+                for moved in node.items:
+                    self._index[moved] = prev
+                prev.items |= node.items
+                self._unlink(node)
+                node = prev.next
+                continue
+            if node.count >= count:
+                break
+            prev = node
+            node = node.next
+        if node is None or node.count != count:
+            new = _Bucket(count, self.epoch)
+            new.prev = prev
+            new.next = node
+            if node is not None:
+                node.prev = new
+            if prev is None:
+                self._head = new
+            else:
+                prev.next = new
+            node = new
+        node.items.add(item)
+        self._index[item] = node
+
+    def _unlink(self, bucket):
+        if bucket.prev is None:
+            self._head = bucket.next
         else:
-            min_item = min(self.counters, key=self.counters.get)
-            self.min_counter = self.counters[min_item]
-            self.counters.pop(min_item)
-            self.counters[item] = self.min_counter + 1
+            bucket.prev.next = bucket.next
+        if bucket.next is not None:
+            bucket.next.prev = bucket.prev
+
+    def _buckets(self):
+        node = self._head
+        while node is not None:
+            self._refresh(node)
+            yield node
+            node = node.next
+
+    def get(self, item, default=0):
+        bucket = self._index.get(item)
+        if bucket is None:
+            return default
+        self._refresh(bucket)
+        return bucket.count
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def decrease(self, aging):
+        # O(1) aging tick; a new factor first settles every bucket on the old one
+        if aging != self.aging:
+            for _ in self._buckets():
+                pass
+            self.aging = aging
+        self.epoch += 1
+        self._total = None
+
+    def total(self):
+        if self._total is None:
+            self._total = sum(bucket.count * len(bucket.items) for bucket in self._buckets())
+        return self._total
+
+    def _rebuild(self, counters):
+        # Reload the Stream-Summary from an item -> count mapping
+        self.load_arrays(list(counters.keys()), list(counters.values()))
+
+    def load_arrays(self, items, counts):
+        """
+        Replace the counters with parallel item/count arrays (e.g. memory-mapped
+        from a snapshot): one sort, then one bucket per distinct count.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        order = np.argsort(counts, kind='stable')
+        sorted_items = np.asarray(items)[order].tolist()
+        sorted_counts = counts[order].tolist()
+        bounds = [0] + (np.flatnonzero(np.diff(counts[order])) + 1).tolist() + [len(sorted_items)]
+        self._index = {}
+        self._head = None
+        tail = None
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            bucket = _Bucket(sorted_counts[start], self.epoch)
+            members = sorted_items[start:end]
+            bucket.items = set(members)
+            self._index.update(dict.fromkeys(members, bucket))
+            bucket.prev = tail
+            if tail is None:
+                self._head = bucket
+            else:
+                tail.next = bucket
+            tail = bucket
+        self._total = int(counts.sum())
+
+    def resize(self, k):
+        """Change the number of counters; shrinking keeps the k largest, as merge() does."""
+        if k < len(self._index):
+            self._rebuild(dict(heapq.nlargest(k, self.get_counters().items(), key=lambda entry: entry[1])))
+        self.k = k
+
+    def merge(self, other):
+        """
+        Fold another summary into this one (mergeable Space-Saving): an item
+        missing from a full summary is credited with that summary's minimum,
+        then the k largest counters are kept. Counts stay overestimates by at
+        most (N_self + N_other) / k, the same bound as one summary over both streams.
+        """
+        mine, theirs = self.get_counters(), other.get_counters()
+        my_min = min(mine.values()) if len(mine) >= self.k else 0
+        their_min = min(theirs.values()) if len(theirs) >= other.k else 0
+        combined = {item: mine.get(item, my_min) + theirs.get(item, their_min) for item in mine.keys() | theirs.keys()}
+        if len(combined) > self.k:
+            combined = dict(heapq.nlargest(self.k, combined.items(), key=lambda entry: entry[1]))
+        self._rebuild(combined)
+        self.legit_traffic.update(other.legit_traffic)
+        self.evictions += other.evictions
+        return self
+
+    def __getstate__(self):
+        # Pickle the counters flat; the bucket list is too deep for the default recursion
+        state = {key: value for key, value in self.__dict__.items() if key not in ('_index', '_head', '_total')}
+        state['counters'] = dict(self.get_counters())
+        return state
+
+    def __setstate__(self, state):
+        counters = state.pop('counters')
+        self.__dict__.update(state)
+        self._rebuild(counters)
+
+    def to_arrays(self, dtype=np.int64):
+        # Items and their counts as two parallel arrays
+        items, counts = [], []
+        for bucket in self._buckets():
+            items.extend(bucket.items)
+            counts.extend([bucket.count] * len(bucket.items))
+        return np.array(items, dtype=dtype), np.array(counts, dtype=np.int64)
 
     def get_counters(self):
-        return self.counters
+        return Counter({item: bucket.count for bucket in self._buckets() for item in bucket.items})
 
     def get_legit_traffic(self):
         return self.legit_traffic  # Retrieve legitimate traffic data
 
+    def freeze(self, dtype=np.int64):
+        """
+        First half of capture(), cheap enough for the packet thread: settle the
+        buckets (one walk over the distinct counts) and copy the item -> bucket
+        index at C speed. The returned build() turns that into prefix/count
+        arrays, e.g. on a writer thread; a bucket's count only changes when it
+        is aged, so the counts read here stay those of the frozen state.
+        """
+        counts = {bucket: bucket.count for bucket in self._buckets()}
+        index = self._index.copy()
+
+        def build():
+            return {'prefixes': np.fromiter(index.keys(), dtype=dtype, count=len(index)),
+                    'counts': np.fromiter(map(counts.__getitem__, index.values()), dtype=np.int64, count=len(index))}
+        return {'k': self.k, 'min_counter': self.min_counter, 'evictions': self.evictions}, build
+
+    def capture(self, dtype=np.int64):
+        # Sketch state as (meta, arrays) for snapshots; restore() is the inverse
+        meta, build = self.freeze(dtype)
+        return meta, build()
+
+    @classmethod
+    def restore(cls, meta, arrays):
+        sketch = _RestoredSpaceSaving(meta['k'], arrays['prefixes'], arrays['counts'])
+        sketch.min_counter = meta['min_counter']
+        sketch.evictions = meta['evictions']
+        return sketch
+
+
+class _RestoredSpaceSaving(SpaceSaving):
+    """
+    A SpaceSaving restored from snapshot arrays (possibly memory-mapped) that
+    builds its Stream-Summary on first use: the first attribute lookup loads
+    the arrays and turns the object into a plain SpaceSaving, so restoring is
+    only the mapping, and once used it runs with no extra checks.
+    """
+    def __init__(self, k, items, counts):
+        super().__init__(k)
+        self._arrays = (items, counts)
+
+    def __getattribute__(self, name):
+        if object.__getattribute__(self, '__class__') is _RestoredSpaceSaving:
+            self.__class__ = SpaceSaving
+            items, counts = self._arrays
+            del self._arrays
+            self.load_arrays(items, counts)
+        return object.__getattribute__(self, name)
+
+    # len() and `in` look these up on the type, past __getattribute__
+    def __len__(self):
+        return self.__len__()
+
+    def __contains__(self, item):
+        return self.__contains__(item)
+
+
+class ExactCounter:
+    """
+    Exact count per item in a plain dict: the accuracy reference for the other
+    sketches. Memory grows with the number of distinct prefixes, and aging
+    rescales every counter, dropping the ones that reach zero.
+    """
+    name = 'exact'
+    enumerable = True
+
+    def __init__(self, k=None):
+        self.k = k  # unused, kept for the common constructor
+        self.min_counter = 0
+        self.evictions = 0
+        self.legit_traffic = Counter()
+        self.counters = {}
+
+    def increment(self, item, legitimate=False, weight=1):
+        if legitimate:
+            self.legit_traffic[item] += weight
+        self.counters[item] = self.counters.get(item, 0) + weight
+
+    def increment_many(self, items, weights, legitimate=False):
+        increment_each(self, items, weights, legitimate)
+
+    def get(self, item, default=0):
+        return self.counters.get(item, default)
+
+    def __contains__(self, item):
+        return item in self.counters
+
+    def __len__(self):
+        return len(self.counters)
+
+    def decrease(self, aging):
+        aged = ((item, int(count * aging)) for item, count in self.counters.items())
+        self.counters = {item: count for item, count in aged if count}
+
+    def total(self):
+        return sum(self.counters.values())
+
+    def merge(self, other):
+        for item, count in other.counters.items():
+            self.counters[item] = self.counters.get(item, 0) + count
+        self.legit_traffic.update(other.legit_traffic)
+        return self
+
+    def load_arrays(self, items, counts):
+        self.counters = dict(zip(np.asarray(items).tolist(), np.asarray(counts).tolist()))
+
+    def to_arrays(self, dtype=np.int64):
+        return (np.fromiter(self.counters.keys(), dtype=dtype, count=len(self.counters)),
+                np.fromiter(self.counters.values(), dtype=np.int64, count=len(self.counters)))
+
+    def get_counters(self):
+        return Counter(self.counters)
+
+    def freeze(self, dtype=np.int64):
+        counters = dict(self.counters)
+
+        def build():
+            return {'prefixes': np.fromiter(counters.keys(), dtype=dtype, count=len(counters)),
+                    'counts': np.fromiter(counters.values(), dtype=np.int64, count=len(counters))}
+        return {'k': self.k}, build
+
+    def capture(self, dtype=np.int64):
+        meta, build = self.freeze(dtype)
+        return meta, build()
+
+    @classmethod
+    def restore(cls, meta, arrays):
+        sketch = cls(meta['k'])
+        sketch.load_arrays(arrays['prefixes'], arrays['counts'])
+        return sketch
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch with conservative update: a depth x width int64 array,
+    one multiply-shift hash per row, and an increment only raises the cells
+    that are below the new minimum estimate, which keeps overestimates far
+    below plain Count-Min. Memory is fixed whatever the traffic, but items
+    cannot be listed, so it only serves point queries (get / get_prefix_count),
+    e.g. for the legitimate-traffic baseline.
+
+    Sized from k by default: width is the power of two at or above 8k.
+    """
+    name = 'count_min'
+    enumerable = False
+    MASK64 = (1 << 64) - 1
+
+    def __init__(self, k, width=None, depth=4, seed=0):
+        self.k = k
+        self.width = width or max(64, 1 << (8 * k - 1).bit_length())
+        if self.width & (self.width - 1):
+            raise ValueError(f"width must be a power of two, got {self.width}")
+        self.depth = depth
+        self.seed = seed
+        self.shift = 64 - (self.width.bit_length() - 1)
+        rng = np.random.default_rng(seed)
+        # Odd multipliers and offsets of the multiply-shift hashes, one pair per row
+        self.multipliers = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64) | np.uint64(1)
+        self.increments = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64)
+        self.rows = [(row * self.width, int(a), int(b)) for row, (a, b) in enumerate(zip(self.multipliers, self.increments))]
+        self.table = np.zeros(depth * self.width, dtype=np.int64)
+        self._cells_view = memoryview(self.table)  # plain int reads, much cheaper than numpy scalars
+        self.min_counter = 0
+        self.evictions = 0
+        self.legit_traffic = Counter()
+        self._total = 0
+
+    def _cells(self, item):
+        item = int(item)  # numpy scalars would wrap the hash arithmetic
+        if item > self.MASK64:
+            item = (item ^ (item >> 64)) & self.MASK64  # fold 128-bit keys
+        mask, shift = self.MASK64, self.shift
+        return [offset + (((a * item + b) & mask) >> shift) for offset, a, b in self.rows]
+
+    def increment(self, item, legitimate=False, weight=1):
+        if legitimate:
+            self.legit_traffic[item] += weight
+        self._total += weight
+        view = self._cells_view
+        cells = self._cells(item)
+        counts = [view[cell] for cell in cells]
+        estimate = min(counts) + weight
+        for cell, count in zip(cells, counts):
+            if count < estimate:
+                view[cell] = estimate
+
+    def increment_many(self, items, weights, legitimate=False):
+        """
+        Conservative update of distinct items in one go: every estimate is read
+        before any cell is raised, so cells may end up lower than with
+        sequential updates, but each stays at or above the counts hashed to it.
+        """
+        items = np.asarray(items)
+        if items.dtype == object:
+            return increment_each(self, items, weights, legitimate)
+        weights = np.asarray(weights, dtype=np.int64)
+        if legitimate:
+            self.legit_traffic.update(dict(zip(items.tolist(), weights.tolist())))
+        self._total += int(weights.sum())
+        keys = items.astype(np.uint64)
+        cells = (keys[None, :] * self.multipliers[:, None] + self.increments[:, None]) >> np.uint64(self.shift)
+        cells = cells.astype(np.int64) + (np.arange(self.depth, dtype=np.int64) * self.width)[:, None]
+        estimates = self.table[cells].min(axis=0) + weights
+        np.maximum.at(self.table, cells.ravel(), np.broadcast_to(estimates, cells.shape).ravel())
+
+    def get(self, item, default=0):
+        view = self._cells_view
+        estimate = min([view[cell] for cell in self._cells(item)])
+        return estimate if estimate else default
+
+    def __contains__(self, item):
+        return self.get(item) > 0
+
+    def decrease(self, aging):
+        # int(count * aging) on every cell; the total is scaled the same way
+        self.table[:] = self.table * aging  # truncates like int(count * aging)
+        self._total = int(self._total * aging)
+
+    def total(self):
+        return self._total
+
+    def merge(self, other):
+        # Cell-wise sums stay overestimates; both sketches must share width, depth and seed
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError("Count-Min sketches of different shape or hashes cannot be merged")
+        self.table += other.table
+        self._total += other._total
+        self.legit_traffic.update(other.legit_traffic)
+        return self
+
+    def get_counters(self):
+        raise TypeError("A Count-Min sketch cannot list its items; use get() for point queries")
+
+    def to_arrays(self, dtype=np.int64):
+        raise TypeError("A Count-Min sketch has no prefix/count arrays to export; capture() snapshots its table")
+
+    def freeze(self, dtype=np.int64):
+        table = self.table.copy()  # the live table keeps changing
+        return {'k': self.k, 'width': self.width, 'depth': self.depth, 'seed': self.seed, 'total': self._total}, \
+            lambda: {'table': table}
+
+    def capture(self, dtype=np.int64):
+        meta, build = self.freeze(dtype)
+        return meta, build()
+
+    @classmethod
+    def restore(cls, meta, arrays):
+        sketch = cls(meta['k'], meta['width'], meta['depth'], meta['seed'])
+        sketch.table[:] = arrays['table']
+        sketch._total = meta['total']
+        return sketch
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_cells_view']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cells_view = memoryview(self.table)
+
+
+# Per-level sketches an RHHH can be built on, by name
+SKETCHES = {sketch.name: sketch for sketch in (SpaceSaving, CountMinSketch, ExactCounter)}
+
+
+@lru_cache(maxsize=None)
+def _z_score(delta):
+    # norm.ppf costs more than the rest of an RHHH; pools create many of them
+    return norm.ppf(1 - delta / 2)
+
+
 class RHHH:
-    def __init__(self, hierarchy_levels, k, aging=0.5, delta=0.05):
+    """
+    Randomized HHH over a prefix hierarchy. `hierarchy_levels` is either a level
+    count (octet prefixes of IPv4) or a list of prefix lengths, see PrefixHierarchy.
+
+    Each packet draws one of V levels and only updates the counter if the draw
+    is one of the H real ones, so with V > H most packets skip the update. Counts
+    then cover an H/V sample of the stream and are scaled back by V/H (`scale`)
+    in output() and get_prefix_count(). V defaults to H: every packet counts.
+
+    `sketch` picks the per-level counter: a name from SKETCHES or a class
+    taking k. output() needs one that can list its items (not count_min).
+    """
+    def __init__(self, hierarchy_levels, k, aging=0.5, delta=0.05, seed=None, family=4, V=None,
+                 sketch='space_saving'):
         self.aging = aging
-        self.hierarchy_levels = hierarchy_levels
-        self.hh_algorithms = [SpaceSaving(k) for _ in range(hierarchy_levels)]
-        self.V = hierarchy_levels
+        self.hierarchy = PrefixHierarchy(hierarchy_levels, family)
+        self.hierarchy_levels = len(self.hierarchy)
+        self.sketch = SKETCHES[sketch] if isinstance(sketch, str) else sketch
+        self.hh_algorithms = [self.sketch(k) for _ in range(self.hierarchy_levels)]
+        self.masks = self.hierarchy.masks
+        self.V = self.hierarchy_levels if V is None else V
+        if self.V < self.hierarchy_levels:
+            raise ValueError(f"V must be at least the number of hierarchy levels ({self.hierarchy_levels}), got {self.V}")
+        self.scale = 1 if self.V == self.hierarchy_levels else self.V / self.hierarchy_levels
         self.delta = delta
+        self.Z = _z_score(delta)
         self.attack_detection_threshold = 0.05  # Set this based on your anomaly detection needs
+        self.rng = np.random.default_rng(seed)  # level draws for update_batch
+
+    def __getstate__(self):
+        # Drop method wrappers set on the instance (Instrumentation); the owning
+        # DNSProtection attaches them again when it is unpickled
+        return {name: value for name, value in self.__dict__.items() if not hasattr(type(self), name)}
 
     def update(self, packet, legitimate=False):
         level = random.randint(0, self.V-1)
+        if level >= self.hierarchy_levels:
+            return
         prefix = self.get_prefix(packet, level)
         self.hh_algorithms[level].increment(prefix, legitimate=legitimate)
 
+    def update_batch(self, packets, legitimate=False):
+        """
+        Vectorized update: one random level per packet drawn in a single call,
+        prefixes masked together, and every distinct (level, prefix) fed to its
+        SpaceSaving once with its count as the weight. Draws past the last level
+        are skipped as in update().
+        """
+        addrs = self.hierarchy.encode(packets)
+        if len(addrs) == 0:
+            return
+        levels = self.rng.integers(0, self.V, size=len(addrs))
+        for level, (hh, mask) in enumerate(zip(self.hh_algorithms, self.masks)):
+            prefixes, counts = np.unique(addrs[levels == level] & mask, return_counts=True)
+            hh.increment_many(prefixes, counts, legitimate=legitimate)
+
     def get_prefix(self, packet, level):
-        parts = packet.split('.')
-        pp = '.'.join(parts[:level+1])
-        return pp
-    
-    def calc_pred(self, p, P):
-        level = len(p.split('.')) - 1
-        sum = 0
-        for pref, count in P:
-            if p == self.get_prefix(pref, level):
-                p_level = len(pref.split('.')) - 1
-                sum += self.hh_algorithms[p_level].get_counters().get(pref, 0)
-        return -sum
+        # Prefixes are keyed by the masked integer address; strings are only built in output()
+        if isinstance(packet, str):
+            packet = self.hierarchy.key(packet)
+        return packet & self.masks[level]
+
+    def total(self):
+        return sum(hh.total() for hh in self.hh_algorithms)
+
+    def resize(self, k):
+        # Same k at every level; needs a sketch with resize() (space_saving)
+        for hh in self.hh_algorithms:
+            hh.resize(k)
+
+    def merge(self, other):
+        # Level-wise SpaceSaving merge of a tracker over another part of the stream
+        for mine, theirs in zip(self.hh_algorithms, other.hh_algorithms):
+            mine.merge(theirs)
+        return self
 
     def output(self, theta):
+        """
+        Single bottom-up pass. `below` maps each prefix of the current level to
+        the summed counters of the HHHs already found underneath it, and is
+        folded onto the parent level before moving up, so a prefix's
+        conditioned frequency is one dict lookup instead of a scan of the set.
+        Counters and N are scaled by V/H to estimate the full stream.
+        """
         hhh_set = set()
-        Z = norm.ppf(1 - self.delta / 2)
-        N = sum(counter for hh in self.hh_algorithms for counter in hh.get_counters().values())
+        scale = self.scale
+        N = self.total() * scale
+        correction = 2 * self.Z * math.sqrt(N * self.V)
+        below = {}
 
         for level in range(self.hierarchy_levels - 1, -1, -1):
-            hh_counters = self.hh_algorithms[level].get_counters()
-            for prefix, count in hh_counters.items():
-                conditioned_frequency = count + self.calc_pred(prefix, hhh_set)
-                adjusted_conditioned_frequency = conditioned_frequency + 2 * Z * math.sqrt(N * self.V)
-
-                # print(f"Prefix: {prefix}, Count: {count}, Conditioned Frequency: {conditioned_frequency}, "
-                #       f"Adjusted Conditioned Frequency: {adjusted_conditioned_frequency}, Threshold: {theta * N}")
+            found = []
+            for prefix, count in self.hh_algorithms[level].get_counters().items():
+                count *= scale
+                conditioned_frequency = count - below.get(prefix, 0)
+                adjusted_conditioned_frequency = conditioned_frequency + correction
 
                 if adjusted_conditioned_frequency >= theta * N:
-                    hhh_set.add((prefix,conditioned_frequency))
+                    hhh_set.add((self.hierarchy.to_str(prefix, level), conditioned_frequency))
+                    found.append((prefix, count))
+
+            if level > 0:
+                parent_mask = self.masks[level - 1]
+                parent_below = defaultdict(int)
+                for prefix, count in below.items():
+                    parent_below[prefix & parent_mask] += count
+                for prefix, count in found:
+                    parent_below[prefix & parent_mask] += count
+                below = parent_below
         return hhh_set
 
     def get_prefix_count(self, pref):
-        return sum([self.hh_algorithms[p_level].get_counters().get(self.get_prefix(pref, p_level), 0) for p_level in range(0, self.hierarchy_levels)])
-        # return sum([self.hh_algorithms[p_level].get_counters().get(pref, 0) for p_level in range(self.hierarchy_levels - 1, -1, -1)])
+        if isinstance(pref, str):
+            pref = self.hierarchy.key(pref)
+        count = sum([hh.get(pref & mask) for hh, mask in zip(self.hh_algorithms, self.masks)])
+        return count if self.scale == 1 else count * self.scale
 
     def decrease(self):
-        for level in range(0, self.hierarchy_levels):
-            hh_counters = self.hh_algorithms[level].get_counters()
-            for prefix in hh_counters.keys():
-                hh_counters[prefix] = int(hh_counters[prefix] * self.aging)
+        for hh in self.hh_algorithms:
+            hh.decrease(self.aging)
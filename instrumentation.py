@@ -0,0 +1,130 @@
+import time
+from collections import Counter, defaultdict, deque
+
+# Per-packet stages of DNSProtection that get a timer: (owner attribute, method)
+TIMED_STAGES = {
+    'process_query': (None, 'process_query'),
+    'decide': (None, 'decide'),
+    'observe': (None, 'observe'),
+    'cleanup_lists': (None, 'cleanup_lists'),
+    'is_under_attack': (None, 'is_under_attack'),
+    'legit_prefix_count': ('rh_legit', 'get_prefix_count'),
+    'attack_prefix_count': ('rh_attack', 'get_prefix_count'),
+    'legit_update': ('rh_legit', 'update'),
+    'attack_update': ('rh_attack', 'update'),
+}
+
+
+class RingBufferSink:
+    """Keep the last `capacity` snapshots in memory."""
+    def __init__(self, capacity=100):
+        self.snapshots = deque(maxlen=capacity)
+
+    def emit(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+class PrometheusTextSink:
+    """Render snapshots in the Prometheus text exposition format, optionally to a file."""
+    def __init__(self, path=None, prefix='dns_protection'):
+        self.path = path
+        self.prefix = prefix
+        self.text = ''
+
+    def emit(self, snapshot):
+        p = self.prefix
+        lines = [f'# TYPE {p}_stage_seconds_total counter']
+        lines += [f'{p}_stage_seconds_total{{stage="{stage}"}} {values["total_ns"] / 1e9:.9f}'
+                  for stage, values in snapshot['stages'].items()]
+        lines.append(f'# TYPE {p}_stage_calls_total counter')
+        lines += [f'{p}_stage_calls_total{{stage="{stage}"}} {values["calls"]}'
+                  for stage, values in snapshot['stages'].items()]
+        lines.append(f'# TYPE {p}_events_total counter')
+        lines += [f'{p}_events_total{{event="{event}"}} {count}' for event, count in snapshot['events'].items()]
+        lines.append(f'# TYPE {p}_evictions_total counter')
+        lines += [f'{p}_evictions_total{{tracker="{tracker}",level="{level}"}} {count}'
+                  for tracker, levels in snapshot['evictions'].items() for level, count in enumerate(levels)]
+        self.text = '\n'.join(lines) + '\n'
+        if self.path is not None:
+            with open(self.path, 'w') as f:
+                f.write(self.text)
+
+
+class Instrumentation:
+    """
+    Stage timers and event counters for a DNSProtection. attach() shadows the
+    timed methods with wrappers on the instances themselves, so a protection
+    built without instrumentation runs the plain methods with no extra checks.
+    Verdicts are counted in observe(), which both process_query and the
+    decide()/observe() pair of the proxy go through. The wrappers are not
+    pickled; an unpickled DNSProtection attaches its instrumentation again.
+    Snapshots go to `sink` every `export_every` packets and on export().
+    """
+    def __init__(self, sink=None, export_every=None):
+        self.sink = sink
+        self.export_every = export_every
+        self.stage_ns = defaultdict(int)
+        self.stage_calls = defaultdict(int)
+        self.events = Counter()
+        self.dns_protection = None
+
+    def attach(self, dns_protection):
+        self.dns_protection = dns_protection
+        for stage, (owner, method) in TIMED_STAGES.items():
+            target = dns_protection if owner is None else getattr(dns_protection, owner)
+            setattr(target, method, self._timed(stage, getattr(target, method)))
+
+        observe = dns_protection.observe
+        def counted_observe(source, alowed, nxd_flg):
+            verdict = observe(source, alowed, nxd_flg)
+            self.events[verdict.lower()] += 1
+            if self.export_every and self.stage_calls['observe'] % self.export_every == 0:
+                self.export()
+            return verdict
+        dns_protection.observe = counted_observe
+
+        is_under_attack = dns_protection.is_under_attack
+        def tracked_is_under_attack():
+            before = dns_protection.under_attack
+            under_attack = is_under_attack()
+            if under_attack != before:
+                self.events['attack_started' if under_attack else 'attack_ended'] += 1
+            return under_attack
+        dns_protection.is_under_attack = tracked_is_under_attack
+
+        decrease = dns_protection.rh_legit.decrease
+        def counted_decrease():
+            self.events['aging_ticks'] += 1
+            decrease()
+        dns_protection.rh_legit.decrease = counted_decrease
+        return dns_protection
+
+    def _timed(self, stage, method):
+        clock = time.perf_counter_ns
+        stage_ns = self.stage_ns
+        stage_calls = self.stage_calls
+        def timed(*args, **kwargs):
+            start = clock()
+            result = method(*args, **kwargs)
+            stage_ns[stage] += clock() - start
+            stage_calls[stage] += 1
+            return result
+        return timed
+
+    def snapshot(self):
+        dns_protection = self.dns_protection
+        evictions = {}
+        if dns_protection is not None:
+            evictions = {'legit': [hh.evictions for hh in dns_protection.rh_legit.hh_algorithms],
+                         'attack': [hh.evictions for hh in dns_protection.rh_attack.hh_algorithms]}
+        return {'timestamp': time.time(),
+                'stages': {stage: {'calls': self.stage_calls[stage], 'total_ns': self.stage_ns[stage]}
+                           for stage in self.stage_calls},
+                'events': dict(self.events),
+                'evictions': evictions}
+
+    def export(self):
+        snapshot = self.snapshot()
+        if self.sink is not None:
+            self.sink.emit(snapshot)
+        return snapshot
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import socket
+import struct
+
+_IPV4 = struct.Struct('!I')
+OCTET_HIERARCHY_MAX = 4
+_OCTET = r'(?:25[0-5]|2[0-4]\d|[01]?\d?\d)'
+DOTTED_QUAD = r'\.'.join([_OCTET] * 4)  # a dotted-quad IPv4 address, every octet 0-255
+
+
+def ip_to_int(ip):
+    """Convert a dotted-quad IPv4 address to its uint32 value."""
+    return _IPV4.unpack(socket.inet_aton(ip))[0]
+
+
+def int_to_ip(addr):
+    """Convert a uint32 IPv4 value back to dotted-quad form."""
+    return socket.inet_ntoa(_IPV4.pack(addr))
+
+
+def ip6_to_int(ip):
+    """Convert an IPv6 address to its 128-bit integer value."""
+    return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+
+
+def int_to_ip6(addr):
+    """Convert a 128-bit integer back to compressed IPv6 form."""
+    return socket.inet_ntop(socket.AF_INET6, addr.to_bytes(16, 'big'))
+
+
+def length_mask(length, bits=32):
+    """Mask keeping the top `length` bits of a `bits`-wide address."""
+    return ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1)
+
+
+def prefix_mask(level):
+    """Mask keeping the first level+1 octets of an IPv4 address."""
+    return length_mask(8 * min(level + 1, OCTET_HIERARCHY_MAX))
+
+
+def encode_ips(values):
+    """Encode a column of IPv4 sources (dotted strings or integers) as a uint32 array."""
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+        return values.astype(np.uint32, copy=False)
+    values = pd.Series(values)
+    if values.dtype.kind in 'iu':
+        return values.to_numpy(dtype=np.uint32)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.uint32)
+    octets = values.astype(str).str.split('.', expand=True).astype(np.uint32).to_numpy()
+    if (octets > 255).any():
+        raise ValueError("IPv4 octets must be at most 255")
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+class PrefixHierarchy:
+    """
+    The prefix lengths tracked by an RHHH, over IPv4 or IPv6 addresses. Sources
+    are integer keys and the prefix at a level is one AND with that level's
+    mask. An int `levels` is the original octet hierarchy (/8, /16, /24, /32);
+    otherwise it lists the prefix lengths, e.g. (8, 16, 20, 24, 32) or (32, 48, 64).
+
+    IPv6 hierarchies that stop at /64 key on the top 64 bits of the address
+    only, so prefixes stay word-sized ints (uint64 arrays) instead of 128-bit ones.
+    """
+    def __init__(self, levels, family=4):
+        if family not in (4, 6):
+            raise ValueError(f"family must be 4 or 6, got {family}")
+        address_bits = 32 if family == 4 else 128
+        if isinstance(levels, int):
+            if family != 4:
+                raise ValueError("IPv6 hierarchies need explicit prefix lengths")
+            lengths = [8 * min(level + 1, OCTET_HIERARCHY_MAX) for level in range(levels)]
+        else:
+            lengths = sorted(int(length) for length in levels)
+        if not lengths or lengths[0] < 1 or lengths[-1] > address_bits:
+            raise ValueError(f"Prefix lengths must be between 1 and {address_bits}, got {lengths}")
+        self.family = family
+        self.lengths = lengths
+        if family == 4:
+            self.key_bits, self.dtype = 32, np.uint32
+        elif lengths[-1] <= 64:
+            self.key_bits, self.dtype = 64, np.uint64
+        else:
+            self.key_bits, self.dtype = 128, object
+        self.shift = address_bits - self.key_bits
+        self.masks = [length_mask(length, self.key_bits) for length in lengths]
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def key(self, address):
+        """Integer key of one address; ints are taken to be keys already."""
+        if not isinstance(address, str):
+            return address
+        if self.family == 4:
+            return ip_to_int(address)
+        return ip6_to_int(address) >> self.shift
+
+    def encode(self, values):
+        """Keys for a column of addresses (strings or already encoded ints)."""
+        if self.family == 4:
+            return encode_ips(values)
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+            return values.astype(self.dtype, copy=False)
+        return np.array([self.key(value) for value in values], dtype=self.dtype)
+
+    def to_str(self, prefix, level):
+        """Octet-aligned IPv4 prefixes keep the short '22.188' form; the rest are CIDR."""
+        length = self.lengths[level]
+        if self.family == 6:
+            return f'{int_to_ip6(prefix << self.shift)}/{length}'
+        if length % 8 == 0:
+            return '.'.join(int_to_ip(prefix).split('.')[:length // 8])
+        return f'{int_to_ip(prefix)}/{length}'
@@ -1,18 +1,30 @@
 from collections import defaultdict, deque
 from hhh import RHHH
+from ip_utils import encode_ips
+import numpy as np
 import pandas as pd
 
+# The Streamlit defaults of every parameter but hierarchy_levels and k, shared by the CLIs
+PROTECTION_PARAMS = dict(upper_threshold_nxd_ratio=0.1, lower_threshold_nxd_ratio=0.05,
+                         upper_attack_threshold_ratio=0.6, lower_attack_threshold_ratio=0.3,
+                         list_expiry_limit=150, aging=0.5)
+
 class DNSProtection:
     def __init__(self, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio, lower_attack_threshold_ratio,
-                  upper_attack_threshold_ratio,hierarchy_levels, aging, k, list_expiry_limit):
+                  upper_attack_threshold_ratio,hierarchy_levels, aging, k, list_expiry_limit,
+                  decision_table=False, table_refresh=1000, instrumentation=None, family=4, V=None,
+                  legit_sketch='space_saving', attack_sketch='space_saving'):
         self.aging = aging
         self.upper_threshold_nxd_ratio = upper_threshold_nxd_ratio
         self.lower_threshold_nxd_ratio = lower_threshold_nxd_ratio
         self.upper_attack_threshold_ratio = upper_attack_threshold_ratio
         self.lower_attack_threshold_ratio = lower_attack_threshold_ratio
         self.list_expiry_limit = list_expiry_limit
-        self.rh_legit = RHHH(hierarchy_levels, k, aging)
-        self.rh_attack = RHHH(hierarchy_levels, k, aging)
+        # hierarchy_levels: a level count (IPv4 octets) or a list of prefix lengths;
+        # V > hierarchy levels makes the trackers skip most updates (see RHHH).
+        # Each tracker has its own sketch; the legit one is only ever point-queried
+        self.rh_legit = RHHH(hierarchy_levels, k, aging, family=family, V=V, sketch=legit_sketch)
+        self.rh_attack = RHHH(hierarchy_levels, k, aging, family=family, V=V, sketch=attack_sketch)
         self.total_queries = 0
         self.queries = 0
         self.total_nxd = 0
@@ -23,14 +35,42 @@ class DNSProtection:
         self.fn = 0
         self.under_attack = False
         self.debug_log = []
+        # Decision-table mode: verdicts come from a per-level prefix -> block map
+        # that is rebuilt on an aging tick, an attack-state change or every
+        # `table_refresh` tracker updates
+        self.decision_table = decision_table
+        if decision_table and not (self.rh_legit.sketch.enumerable and self.rh_attack.sketch.enumerable):
+            raise ValueError("The decision table lists tracked prefixes, which a count_min sketch cannot do")
+        self.table_refresh = table_refresh
+        self.table = None
+        self.table_under_attack = False
+        self.table_updates = 0
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.attach(self)
 
-    def log_normal_traffic(self, packet):
+    def __getstate__(self):
+        # Instrumentation wrappers are closures on the instance and cannot be pickled
+        return {name: value for name, value in self.__dict__.items() if not hasattr(type(self), name)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.instrumentation is not None:
+            self.instrumentation.attach(self)
+
+    def get_source(self, packet):
+        # Sources are handled as integer keys from here on; address strings are encoded once
         source = packet['Source']
+        return self.rh_legit.hierarchy.key(source) if isinstance(source, str) else int(source)
+
+    def log_normal_traffic(self, packet):
+        source = self.get_source(packet)
         self.rh_legit.update(source, legitimate=True)
 
     def packet_allowed(self, packet):
-        source = packet['Source']
-        
+        return self.source_allowed(self.get_source(packet))
+
+    def source_allowed(self, source):
         # Clean up expired entries from blacklist and whitelist
         self.cleanup_lists()
 
@@ -40,21 +80,41 @@ class DNSProtection:
             return "Allow"
 
     def process_packet(self, packet):
-        alowed = self.packet_allowed(packet)
-        source = packet['Source']
+        return self.process_query(self.get_source(packet), self.is_nxd(packet))
+
+    def process_query(self, source, nxd_flg):
+        # Per-packet path on an already encoded source and NXD flag
+        self.cleanup_lists()
+        return self.apply_query(source, nxd_flg)
+
+    def apply_query(self, source, nxd_flg):
+        # Verdict and bookkeeping for one query, with aging left to the caller
+        return self.observe(source, self.count_query(source), nxd_flg)
+
+    def decide(self, source):
+        # Verdict half of process_query, for callers that only learn the NXD flag
+        # later (from the resolver's answer) and report it through observe()
+        self.cleanup_lists()
+        return self.count_query(source)
+
+    def count_query(self, source):
+        alowed = "Block" if self.should_block(source) else "Allow"
 
         self.total_queries += 1
         self.queries += 1
+        return alowed
 
-        nxd_flg = self.is_nxd(packet)
-
+    def observe(self, source, alowed, nxd_flg):
         if alowed == 'Allow':
             if nxd_flg:
                 self.total_nxd += 1
                 self.nxd += 1
                 self.rh_attack.update(source)
+                if self.table is not None:
+                    self.patch_table(source)
             else:
-                self.log_normal_traffic(packet)
+                self.rh_legit.update(source, legitimate=True)
+            self.table_updates += 1
 
             if not nxd_flg:
                 self.tp += 1
@@ -69,6 +129,32 @@ class DNSProtection:
 
         return alowed
 
+    def process_batch(self, sources, legitimate):
+        """
+        Ingest a batch of queries without per-packet blocking: every query is
+        logged into rh_legit or rh_attack as if allowed, for warm-up and for
+        replaying logged traffic. Aging still fires at the same query counts as
+        in process_packet; the TP/FP/TN/FN counters are left untouched.
+        """
+        sources = self.rh_legit.hierarchy.encode(sources)
+        nxd_flags = ~np.asarray(legitimate, dtype=bool)
+        pos = 0
+        while pos < len(sources):
+            self.cleanup_lists()
+            step = min(len(sources) - pos, self.list_expiry_limit - self.total_queries % self.list_expiry_limit)
+            chunk_sources = sources[pos:pos + step]
+            chunk_nxd = nxd_flags[pos:pos + step]
+            self.rh_attack.update_batch(chunk_sources[chunk_nxd])
+            self.rh_legit.update_batch(chunk_sources[~chunk_nxd], legitimate=True)
+
+            nxd_count = int(chunk_nxd.sum())
+            self.total_queries += step
+            self.queries += step
+            self.total_nxd += nxd_count
+            self.nxd += nxd_count
+            self.is_under_attack()
+            pos += step
+
     def is_nxd(self, packet):
         return packet['Legitimate'] == 'False' or packet['Legitimate'] == False
 
@@ -83,6 +169,8 @@ class DNSProtection:
         return self.under_attack
 
     def should_block(self, source):
+        if self.decision_table:
+            return self.table_blocks(source)
         legit_freq = self.rh_legit.get_prefix_count(source)
         attack_freq = self.rh_attack.get_prefix_count(source)
 
@@ -96,14 +184,107 @@ class DNSProtection:
     def cleanup_lists(self):
         # Remove expired entries from blacklist
         if self.total_queries % self.list_expiry_limit == 0:
-            self.queries = int(self.queries * self.aging)
-            self.nxd = int(self.nxd * self.aging)
-            self.rh_legit.decrease()
-            self.rh_attack.decrease()
+            self.age()
+
+    def age(self):
+        self.queries = int(self.queries * self.aging)
+        self.nxd = int(self.nxd * self.aging)
+        self.rh_legit.decrease()
+        self.rh_attack.decrease()
+        self.table = None
+
+    def table_blocks(self, source):
+        under_attack = self.is_under_attack()
+        if self.table is None or under_attack != self.table_under_attack or self.table_updates >= self.table_refresh:
+            self.build_table(under_attack)
+        # The deepest stored prefix of the source decides
+        for mask, level_table in self.table:
+            blocked = level_table.get(source & mask)
+            if blocked is not None:
+                return blocked
+        return False
+
+    def build_table(self, under_attack):
+        """
+        Precompute should_block for every prefix tracked by either RHHH: the
+        verdict for a source whose deepest tracked prefix it is, from attack and
+        legit counts summed along the prefix's ancestor chain. Only prefixes
+        whose verdict differs from their nearest tracked ancestor's are kept,
+        so outside an attack the table is nearly empty.
+        """
+        ratio = self.lower_attack_threshold_ratio if under_attack else self.upper_attack_threshold_ratio
+        masks = self.rh_legit.masks
+        dtype = self.rh_legit.hierarchy.dtype
+        levels = []  # per level: sorted prefixes, chain sums and verdicts
+        self.table = []
+        for level in range(self.rh_legit.hierarchy_levels):
+            attack_prefixes, attack_counts = self.rh_attack.hh_algorithms[level].to_arrays(dtype)
+            legit_prefixes, legit_counts = self.rh_legit.hh_algorithms[level].to_arrays(dtype)
+            prefixes = np.union1d(attack_prefixes, legit_prefixes)
+            attack_sum = np.zeros(len(prefixes), dtype=np.int64)
+            legit_sum = np.zeros(len(prefixes), dtype=np.int64)
+            attack_sum[np.searchsorted(prefixes, attack_prefixes)] = attack_counts
+            legit_sum[np.searchsorted(prefixes, legit_prefixes)] = legit_counts
+
+            inherited = np.zeros(len(prefixes), dtype=bool)
+            if level:
+                ancestor_attack, ancestor_legit, inherited = self._nearest_ancestor(levels, prefixes)
+                attack_sum += ancestor_attack
+                legit_sum += ancestor_legit
+            blocked = attack_sum > legit_sum * ratio
+            levels.append((prefixes, attack_sum, legit_sum, blocked))
+
+            keep = blocked != inherited
+            self.table.append((masks[level], dict(zip(prefixes[keep].tolist(), blocked[keep].tolist()))))
+        self.table.reverse()
+        self.table_under_attack = under_attack
+        self.table_updates = 0
+
+    def patch_table(self, source):
+        # An NXD from an allowed source is what can flip it to Block, so its
+        # deepest prefix gets the exact verdict right away instead of waiting
+        # for the next rebuild. Every source under that prefix shares the chain.
+        if self.table_under_attack:
+            ratio = self.lower_attack_threshold_ratio
+        else:
+            ratio = self.upper_attack_threshold_ratio
+        mask, level_table = self.table[0]
+        blocked = self.rh_attack.get_prefix_count(source) > self.rh_legit.get_prefix_count(source) * ratio
+        level_table[source & mask] = blocked
+
+    def _nearest_ancestor(self, levels, prefixes):
+        # Chain sums and verdict of each prefix's deepest tracked ancestor
+        attack_sum = np.zeros(len(prefixes), dtype=np.int64)
+        legit_sum = np.zeros(len(prefixes), dtype=np.int64)
+        blocked = np.zeros(len(prefixes), dtype=bool)
+        pending = np.arange(len(prefixes))
+        for level in range(len(levels) - 1, -1, -1):
+            if len(pending) == 0:
+                break
+            level_prefixes, level_attack, level_legit, level_blocked = levels[level]
+            wanted = prefixes[pending] & self.rh_legit.masks[level]
+            idx = np.minimum(np.searchsorted(level_prefixes, wanted), max(len(level_prefixes) - 1, 0))
+            found = level_prefixes[idx] == wanted if len(level_prefixes) else np.zeros(len(wanted), dtype=bool)
+            attack_sum[pending[found]] = level_attack[idx[found]]
+            legit_sum[pending[found]] = level_legit[idx[found]]
+            blocked[pending[found]] = level_blocked[idx[found]]
+            pending = pending[~found]
+        return attack_sum, legit_sum, blocked
+
+def encode_trace(dataset, hierarchy=None):
+    """
+    Columnar view of a trace for simulate_attack_arrays: uint32 sources (or the
+    keys of `hierarchy`, a PrefixHierarchy, e.g. for IPv6) and a bool
+    Legitimate array, read the same way is_nxd reads a packet.
+    """
+    legitimate = dataset['Legitimate']
+    nxd_flags = (legitimate == False) | (legitimate.astype(str) == 'False')
+    sources = encode_ips(dataset['Source']) if hierarchy is None else hierarchy.encode(dataset['Source'])
+    return sources, ~nxd_flags.to_numpy(dtype=bool)
 
 def simulate_attack(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio,
                     upper_attack_threshold_ratio, lower_attack_threshold_ratio, list_expiry_limit,
-                    aging, k, packets):
+                    aging, k, packets, decision_table=False, table_refresh=1000):
     dns_protection = DNSProtection(
         upper_threshold_nxd_ratio=upper_threshold_nxd_ratio, 
         lower_threshold_nxd_ratio=lower_threshold_nxd_ratio, 
@@ -112,9 +293,43 @@ def simulate_attack(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold
         hierarchy_levels=hierarchy_levels, 
         aging=aging, 
         k=k, 
-        list_expiry_limit=list_expiry_limit  
+        list_expiry_limit=list_expiry_limit,
+        decision_table=decision_table,
+        table_refresh=table_refresh
     )
 
     for packet in packets:
         _ = dns_protection.process_packet(packet)
     return dns_protection
+
+def simulate_attack_arrays(hierarchy_levels, upper_threshold_nxd_ratio, lower_threshold_nxd_ratio,
+                           upper_attack_threshold_ratio, lower_attack_threshold_ratio, list_expiry_limit,
+                           aging, k, sources, legitimate, decision_table=False, table_refresh=1000, family=4, V=None,
+                           legit_sketch='space_saving', attack_sketch='space_saving'):
+    """
+    simulate_attack over columnar input (see encode_trace) instead of a list of
+    packet dicts. Returns the protection object and a bool array that is True
+    where the packet was allowed.
+    """
+    dns_protection = DNSProtection(
+        upper_threshold_nxd_ratio=upper_threshold_nxd_ratio,
+        lower_threshold_nxd_ratio=lower_threshold_nxd_ratio,
+        upper_attack_threshold_ratio=upper_attack_threshold_ratio,
+        lower_attack_threshold_ratio=lower_attack_threshold_ratio,
+        hierarchy_levels=hierarchy_levels,
+        aging=aging,
+        k=k,
+        list_expiry_limit=list_expiry_limit,
+        decision_table=decision_table,
+        table_refresh=table_refresh,
+        family=family,
+        V=V,
+        legit_sketch=legit_sketch,
+        attack_sketch=attack_sketch
+    )
+
+    process_query = dns_protection.process_query
+    verdicts = np.fromiter((process_query(source, not legit) == 'Allow'
+                            for source, legit in zip(np.asarray(sources).tolist(), np.asarray(legitimate).tolist())),
+                           dtype=bool, count=len(sources))
+    return dns_protection, verdicts
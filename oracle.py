@@ -0,0 +1,182 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import nxd_detecter as nxd
+from attack_traces import load_data, synthetic_attack_dataset
+from hhh import RHHH
+from ip_utils import encode_ips
+
+RESULT_FIELDS = ['trace', 'window_start', 'window_size', 'stream', 'hierarchy_levels', 'k', 'V', 'sketch', 'theta',
+                 'exact_hhhs', 'reported_hhhs', 'false_hhhs', 'missed_hhhs', 'count_error', 'max_count_error',
+                 'memory_bytes', 'updates_per_sec']
+
+
+def exact_hhh(sources, theta, hierarchy):
+    """
+    Exact HHHs of a window of sources under RHHH.output's rules, as the same
+    set of (prefix string, conditioned frequency). One np.unique group-by per
+    level, bottom-up: a prefix's conditioned frequency is its count minus the
+    counts of the HHHs found under it (folded level by level exactly as
+    output() folds `below`), and it is an HHH when that reaches theta * N.
+    There is no sampling, so no V/H scaling and no Z correction.
+    """
+    keys = hierarchy.encode(sources)
+    threshold = theta * len(keys)
+    hhh_set = set()
+    below_prefixes = np.empty(0, dtype=keys.dtype)
+    below_counts = np.empty(0, dtype=np.int64)
+    for level in range(len(hierarchy) - 1, -1, -1):
+        prefixes, counts = np.unique(keys & hierarchy.masks[level], return_counts=True)
+        # below_prefixes is sorted and every one of them is a prefix of this level
+        conditioned = counts - _lookup(below_prefixes, below_counts, prefixes)
+        found = conditioned >= threshold
+        hhh_set.update((hierarchy.to_str(prefix, level), count)
+                       for prefix, count in zip(prefixes[found].tolist(), conditioned[found].tolist()))
+        if level > 0:
+            parents = np.concatenate([below_prefixes, prefixes[found]]) & hierarchy.masks[level - 1]
+            below_prefixes, inverse = np.unique(parents, return_inverse=True)
+            below_counts = np.bincount(inverse, weights=np.concatenate([below_counts, counts[found]]),
+                                       minlength=len(below_prefixes)).astype(np.int64)
+    return hhh_set
+
+
+def _lookup(keys, values, queries):
+    # values[keys == query] for each query, 0 where the key is absent; keys sorted
+    if len(keys) == 0:
+        return np.zeros(len(queries), dtype=np.int64)
+    positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[positions] == queries, values[positions], 0)
+
+
+def compare(estimated, exact, N):
+    """False and missed HHHs of an RHHH.output set, and its conditioned-count error relative to N."""
+    estimated, exact = dict(estimated), dict(exact)
+    common = estimated.keys() & exact.keys()
+    errors = [abs(estimated[prefix] - exact[prefix]) / N for prefix in common] if N else []
+    return {'exact_hhhs': len(exact), 'reported_hhhs': len(estimated),
+            'false_hhhs': len(estimated.keys() - exact.keys()), 'missed_hhhs': len(exact.keys() - estimated.keys()),
+            'count_error': float(np.mean(errors)) if errors else 0.0,
+            'max_count_error': float(max(errors)) if errors else 0.0}
+
+
+def evaluate(sources, hierarchy_levels, k, theta, V=None, sketch='space_saving', seed=0):
+    """
+    Feed one window to a fresh RHHH packet by packet (the blocking path's
+    update) and score its output(theta) against exact_hhh. The window is fed
+    twice with the same seed: timed, then under tracemalloc for the memory
+    the tracker holds afterwards (tracing slows every allocation).
+    """
+    packets = sources.tolist()
+    random.seed(seed)
+    rhhh = RHHH(hierarchy_levels, k, V=V, sketch=sketch)
+    update = rhhh.update
+    start = time.perf_counter()
+    for source in packets:
+        update(source)
+    elapsed = time.perf_counter() - start
+
+    random.seed(seed)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    measured = RHHH(hierarchy_levels, k, V=V, sketch=sketch)
+    for source in packets:
+        measured.update(source)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    result = compare(rhhh.output(theta), exact_hhh(sources, theta, rhhh.hierarchy), len(sources))
+    result.update(memory_bytes=memory, updates_per_sec=len(sources) / elapsed if elapsed else float('inf'))
+    return result
+
+
+def windows(length, size=None, step=None):
+    """(start, end) of every window of `size` packets, `step` apart (default: back to back)."""
+    size = size or length
+    step = step or size
+    return [(start, min(start + size, length)) for start in range(0, max(length - size, 0) + 1, step)]
+
+
+def evaluate_window(trace, start, sources, stream, configs, thetas, seed=0):
+    rows = []
+    for (hierarchy_levels, k, V, sketch), theta in itertools.product(configs, thetas):
+        result = evaluate(sources, hierarchy_levels, k, theta, V, sketch, seed)
+        levels = hierarchy_levels if isinstance(hierarchy_levels, int) else ','.join(map(str, hierarchy_levels))
+        rows.append(dict(result, trace=trace, window_start=start, window_size=len(sources), stream=stream,
+                         hierarchy_levels=levels, k=k, V=V, sketch=sketch, theta=theta))
+    return rows
+
+
+def parse_levels(value):
+    """'2' is a level count (octets), '8,16,24' a list of prefix lengths."""
+    lengths = [int(length) for length in value.split(',') if length.strip()]
+    return lengths[0] if len(lengths) == 1 else lengths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RHHH output against exact HHHs over many traces and windows')
+    parser.add_argument('--trace', action='append', default=[],
+                        help='CSV trace or columnar directory; repeat for several; default is synthetic attack traces')
+    parser.add_argument('--synthetic', type=int, default=1, help='synthetic traces (one per seed) when no --trace is given')
+    parser.add_argument('--packets', type=int, default=10000, help='legitimate packets per synthetic trace')
+    parser.add_argument('--attack-volume', type=float, default=3.0)
+    parser.add_argument('--stream', choices=('all', 'attack', 'legit'), default='attack',
+                        help='which packets the trackers see: the attack tracker only sees NXD traffic')
+    parser.add_argument('--window', type=int, help='packets per window (default: the whole trace)')
+    parser.add_argument('--step', type=int, help='packets between window starts (default: the window size)')
+    parser.add_argument('--levels', action='append', default=[], metavar='H or L1,L2,...',
+                        help='a hierarchy (level count or prefix lengths); repeat for several; default 2')
+    parser.add_argument('--k', default='10,100', help='comma-separated k values')
+    parser.add_argument('--V', default='', help='comma-separated V values (default: the hierarchy levels)')
+    parser.add_argument('--sketch', default='space_saving', help='comma-separated sketches that can list items')
+    parser.add_argument('--theta', default='0.01,0.05', help='comma-separated HHH thresholds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='CSV file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    if args.trace:
+        traces = [(path, load_data(path)) for path in args.trace]
+    else:
+        traces = [(f'synthetic-{seed}', synthetic_attack_dataset(args.packets, args.attack_volume, seed=seed))
+                  for seed in range(args.seed, args.seed + args.synthetic)]
+    configs = list(itertools.product([parse_levels(levels) for levels in args.levels or ['2']],
+                                     [int(k) for k in args.k.split(',')],
+                                     [int(V) for V in args.V.split(',')] if args.V else [None],
+                                     args.sketch.split(',')))
+    thetas = [float(theta) for theta in args.theta.split(',')]
+
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = []
+            for name, dataset in traces:
+                if 'Legitimate' in dataset:
+                    sources, legitimate = nxd.encode_trace(dataset)
+                else:
+                    # Like trace_stream: a trace without labels is all legitimate traffic
+                    sources, legitimate = encode_ips(dataset['Source']), np.ones(len(dataset), dtype=bool)
+                if args.stream != 'all':
+                    sources = sources[legitimate if args.stream == 'legit' else ~legitimate]
+                for start, end in windows(len(sources), args.window, args.step):
+                    futures.append(pool.submit(evaluate_window, name, start, sources[start:end], args.stream,
+                                               configs, thetas, args.seed))
+            for future in as_completed(futures):
+                writer.writerows(future.result())
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import streamlit as st
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
+from ip_utils import int_to_ip
+
+TIME_RESOLUTION = 0.01  # finest time bucket, in the units of the Time column
+MAX_TIME_BINS = 500  # cap on bars in the time chart, whatever the trace size
 
 def colored_ip_line(ip, sub_len):
     part1 = '' if sub_len == 0 else '.'.join(ip.split('.')[:sub_len])
@@ -8,24 +13,40 @@ def colored_ip_line(ip, sub_len):
     # splited_ip = [('.'.join(ip.split('.')[:subnet_len]), '.'.join(ip.split('.')[subnet_len:])) for ip in botnets]
     return f"<span style='color: red;'>{part1}</span>.<span style='color: blue;'>{part2}</span>"
 
+def time_histogram(times, resolution=TIME_RESOLUTION, max_bins=MAX_TIME_BINS):
+    """
+    Packets per time bucket: `resolution`-wide buckets for short traces, widened
+    so there are at most `max_bins` of them for long ones. Returns (counts, edges).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(1)
+    start, end = times.min(), times.max()
+    bins = int(min(max(np.ceil((end - start) / resolution), 1), max_bins))
+    return np.histogram(times, bins=bins, range=(start, end if end > start else start + resolution))
+
+
+def top_sources(sources, n=5):
+    """The n busiest sources and their packet counts, busiest first."""
+    codes, uniques = pd.factorize(np.asarray(sources))
+    counts = np.bincount(codes, minlength=len(uniques))
+    n = min(n, len(counts))
+    if n == 0:
+        return []
+    top = np.argpartition(-counts, n - 1)[:n]
+    top = top[np.argsort(-counts[top], kind='stable')]
+    return list(zip(uniques[top].tolist(), counts[top].tolist()))
+
+
 def plot_statistics(packets, tp, fp, tn, fn):
-    packet_times = {}
-    packet_sources = {}
-    for packet in packets:
-        time = round(packet['Time'], 2)
-        if time not in packet_times:
-            packet_times[time] = 0
-        if packet['Source'] not in packet_sources:
-            packet_sources[packet['Source']] = 0
-        packet_times[time] += 1
-        packet_sources[packet['Source']] += 1
+    counts, edges = time_histogram(packets['Time'].to_numpy())
 
     # Packet Distribution over Time
     plt.figure(figsize=(10, 6))
-    plt.bar(list(packet_times.keys()), list(packet_times.values()), color='blue')
+    plt.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color='blue')
     plt.title('Packet Distribution Over Time')
     plt.xlabel('Time')
-    plt.ylabel('Frequency')
+    plt.ylabel(f'Packets per {edges[1] - edges[0]:.2g}s' if len(counts) else 'Frequency')
     plt.grid(True)
     st.pyplot(plt.gcf())  # Use st.pyplot to display the plot in Streamlit
 
@@ -147,10 +168,10 @@ def plot_statistics(packets, tp, fp, tn, fn):
     st.write("**Formula:** $\\text{Type 2 Error} = \\frac{FN}{TP + FN}$")
 
     # Legitimate vs Attack Traffic
-    legitimate_traffic = [p for p in packets if p['Legitimate']]
-    attack_traffic = [p for p in packets if not p['Legitimate']]  # Adjusted this line
+    legitimate_traffic = int(packets['Legitimate'].astype(bool).sum())
+    attack_traffic = len(packets) - legitimate_traffic
     plt.figure(figsize=(6, 4))
-    plt.bar(['Legitimate Traffic', 'Attack Traffic'], [len(legitimate_traffic), len(attack_traffic)], color=['blue', 'orange'])
+    plt.bar(['Legitimate Traffic', 'Attack Traffic'], [legitimate_traffic, attack_traffic], color=['blue', 'orange'])
     plt.title('Legitimate vs Attack Traffic')
     plt.ylabel('Count')
     st.pyplot(plt.gcf())
@@ -170,7 +191,6 @@ def plot_statistics(packets, tp, fp, tn, fn):
         st.markdown(colored_ip_line(ip, subnet_len), unsafe_allow_html=True)
 
     # Additional Information (Top 5 IPs by Traffic)
-    top_ips = dict(sorted(packet_sources.items(), key=lambda item: item[1], reverse=True)[:min(5, len(packet_sources))])
     st.write("### Top 5 IPs by Traffic:")
-    for ip, traffic_count in top_ips.items():
-        st.write(f"{ip}: {traffic_count}")
+    for ip, traffic_count in top_sources(packets['Source'], 5):
+        st.write(f"{ip if isinstance(ip, str) else int_to_ip(int(ip))}: {traffic_count}")
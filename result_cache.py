@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def file_fingerprint(path):
+    """Cheap fingerprint of an input file: its path, size and modification time."""
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def trace_fingerprint(dataset):
+    """Content hash of a trace DataFrame, row hashes via pandas plus the column names."""
+    digest = hashlib.sha256(','.join(map(str, dataset.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(dataset, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(name, params, *inputs):
+    """Content address of one computation: what ran, with which parameters, over which inputs."""
+    payload = json.dumps({'name': name, 'params': params, 'inputs': inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-level cache for expensive results keyed by cache_key(). The memory
+    layer is an LRU bounded by the pickled size of its entries (`max_bytes`);
+    with a `directory` every result is also written there and survives
+    restarts, bounded by `max_disk_bytes` (oldest files removed first).
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+    def __init__(self, max_bytes=512 * 2 ** 20, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Streamlit runs sessions on separate threads
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get_or_compute(self, key, compute):
+        found, value = self.get(key)
+        if not found:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+        path = self._path(key)
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)  # pruning drops the least recently used files
+            except FileNotFoundError:
+                pass
+            else:
+                value = pickle.loads(data)
+                self._remember(key, value, len(data))
+                self.hits += 1
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, value, len(data))
+        path = self._path(key)
+        if path is not None:
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self.lock:
+                self._prune_disk()
+
+    def _remember(self, key, value, size):
+        if size > self.max_bytes:
+            return  # would evict everything else; the disk layer still has it
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def _path(self, key):
+        return None if self.directory is None else os.path.join(self.directory, key + '.pkl')
+
+    def _prune_disk(self):
+        if self.max_disk_bytes is None:
+            return
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.pkl')]
+        stats = sorted((os.stat(path).st_mtime, os.stat(path).st_size, path) for path in files)
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
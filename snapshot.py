@@ -0,0 +1,205 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from hhh import RHHH
+from nxd_detecter import DNSProtection
+
+TRACKERS = ('rh_legit', 'rh_attack')
+SCALARS = ('total_queries', 'queries', 'total_nxd', 'nxd', 'tp', 'fp', 'tn', 'fn', 'under_attack')
+UINT64_MASK = (1 << 64) - 1
+
+
+def freeze_rhhh(rhhh, include_legit_traffic=False):
+    """
+    Meta of one RHHH and a build() for its arrays: per level, whatever its
+    sketch keeps (prefixes and counts, or a Count-Min table). Only the copies
+    taken by each sketch's freeze() happen here; build() can run on another
+    thread. The unbounded legit_traffic counters play no part in detection
+    and are only included on request.
+    """
+    meta = {'hierarchy_levels': rhhh.hierarchy.lengths, 'family': rhhh.hierarchy.family, 'V': rhhh.V,
+            'k': rhhh.hh_algorithms[0].k, 'aging': rhhh.aging, 'delta': rhhh.delta, 'sketch': rhhh.sketch.name,
+            'rng': rhhh.rng.bit_generator.state, 'levels': []}
+    dtype = rhhh.hierarchy.dtype
+    builds = []
+    for hh in rhhh.hh_algorithms:
+        level_meta, build = hh.freeze(dtype)
+        meta['levels'].append(level_meta)
+        builds.append((build, dict(hh.legit_traffic) if include_legit_traffic else None))
+
+    def build_arrays():
+        arrays = {}
+        for level, (build, legit_traffic) in enumerate(builds):
+            arrays.update({f'{level}_{key}': array for key, array in build().items()})
+            if legit_traffic is None:
+                continue
+            arrays[f'{level}_legit_prefixes'] = np.fromiter(legit_traffic.keys(), dtype=dtype, count=len(legit_traffic))
+            arrays[f'{level}_legit_counts'] = np.fromiter(legit_traffic.values(), dtype=np.int64, count=len(legit_traffic))
+        return {key: _pack_keys(array) for key, array in arrays.items()}
+    return meta, build_arrays
+
+
+def _pack_keys(array):
+    # 128-bit IPv6 keys are Python ints in object arrays, which np.load cannot
+    # memory-map; store them as (n, 2) uint64 hi/lo words instead
+    if array.dtype != object:
+        return array
+    keys = array.tolist()
+    return np.array([(key >> 64, key & UINT64_MASK) for key in keys], dtype=np.uint64).reshape(len(keys), 2)
+
+
+def _unpack_keys(array):
+    if array.ndim != 2:
+        return array
+    hi, lo = array[:, 0].astype(object), array[:, 1].astype(object)
+    return (hi << 64) | lo
+
+
+def capture_rhhh(rhhh, include_legit_traffic=False):
+    meta, build = freeze_rhhh(rhhh, include_legit_traffic)
+    return meta, build()
+
+
+def restore_rhhh(meta, arrays):
+    rhhh = RHHH(meta['hierarchy_levels'], meta['k'], meta['aging'], meta['delta'], family=meta['family'], V=meta['V'],
+                sketch=meta['sketch'])
+    rhhh.rng.bit_generator.state = meta['rng']
+    for level, level_meta in enumerate(meta['levels']):
+        prefix = f'{level}_'
+        level_arrays = {key[len(prefix):]: _unpack_keys(array) for key, array in arrays.items() if key.startswith(prefix)}
+        hh = rhhh.sketch.restore(level_meta, level_arrays)
+        if 'legit_prefixes' in level_arrays:
+            hh.legit_traffic.update(dict(zip(level_arrays['legit_prefixes'].tolist(), level_arrays['legit_counts'].tolist())))
+        rhhh.hh_algorithms[level] = hh
+    return rhhh
+
+
+def freeze(dns_protection, include_legit_traffic=False):
+    """
+    Freeze the learned state of a DNSProtection: meta plus a build() that
+    returns its arrays. This is the only part that must run between packets
+    (dict and table copies, no per-item Python work); build() and writing
+    the arrays out can happen elsewhere.
+    """
+    meta = {
+        'params': {
+            'upper_threshold_nxd_ratio': dns_protection.upper_threshold_nxd_ratio,
+            'lower_threshold_nxd_ratio': dns_protection.lower_threshold_nxd_ratio,
+            'upper_attack_threshold_ratio': dns_protection.upper_attack_threshold_ratio,
+            'lower_attack_threshold_ratio': dns_protection.lower_attack_threshold_ratio,
+            'hierarchy_levels': dns_protection.rh_legit.hierarchy.lengths,
+            'family': dns_protection.rh_legit.hierarchy.family,
+            'V': dns_protection.rh_legit.V,
+            'legit_sketch': dns_protection.rh_legit.sketch.name,
+            'attack_sketch': dns_protection.rh_attack.sketch.name,
+            'aging': dns_protection.aging,
+            'k': dns_protection.rh_legit.hh_algorithms[0].k,
+            'list_expiry_limit': dns_protection.list_expiry_limit,
+        },
+        'scalars': {name: getattr(dns_protection, name) for name in SCALARS},
+        'trackers': {},
+    }
+    builds = {}
+    for name in TRACKERS:
+        meta['trackers'][name], builds[name] = freeze_rhhh(getattr(dns_protection, name), include_legit_traffic)
+
+    def build_arrays():
+        return {f'{name}_{key}': array for name, build in builds.items() for key, array in build().items()}
+    return meta, build_arrays
+
+
+def capture(dns_protection, include_legit_traffic=False):
+    """Copy the learned state of a DNSProtection into plain arrays (freeze and build in one go)."""
+    meta, build = freeze(dns_protection, include_legit_traffic)
+    return meta, build()
+
+
+def restore(meta, arrays, **options):
+    """
+    Rebuild a DNSProtection from captured state. Options go to the
+    constructor and override the captured params, e.g. decision_table or the
+    threshold ratios of a run resuming from another run's checkpoint.
+    """
+    dns_protection = DNSProtection(**dict(meta['params'], **options))
+    for name in TRACKERS:
+        prefix = f'{name}_'
+        tracker_arrays = {key[len(prefix):]: array for key, array in arrays.items() if key.startswith(prefix)}
+        setattr(dns_protection, name, restore_rhhh(meta['trackers'][name], tracker_arrays))
+    for name, value in meta['scalars'].items():
+        setattr(dns_protection, name, value)
+    return dns_protection
+
+
+def write_snapshot(captured, path):
+    """
+    Write captured state as a directory of .npy files plus meta.json. The
+    directory is filled under a temporary name and renamed into place, so a
+    reader never sees a half-written snapshot.
+    """
+    meta, arrays = captured
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp_path, key + '.npy'), array)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _write_frozen(frozen, path):
+    meta, build = frozen
+    return write_snapshot((meta, build()), path)
+
+
+def save_snapshot(dns_protection, path, include_legit_traffic=False):
+    return write_snapshot(capture(dns_protection, include_legit_traffic), path)
+
+
+def load_snapshot(path, **options):
+    """
+    Restore a DNSProtection from a snapshot directory, memory-mapping its
+    arrays. Space-Saving levels are only built from them on first use.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+              for name in os.listdir(path) if name.endswith('.npy')}
+    return restore(meta, arrays, **options)
+
+
+class BackgroundSnapshotter:
+    """
+    Periodic snapshots for a live DNSProtection. Call maybe_snapshot() from the
+    packet loop: every `every_queries` queries the state is frozen in place
+    (see freeze) and turned into arrays and written out by a background
+    thread, so the loop only pays for the dict and table copies.
+    """
+    def __init__(self, dns_protection, path, every_queries=100000):
+        self.dns_protection = dns_protection
+        self.path = path
+        self.every_queries = every_queries
+        self.last_queries = dns_protection.total_queries
+        self.pending = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def maybe_snapshot(self):
+        if self.dns_protection.total_queries - self.last_queries >= self.every_queries:
+            self.snapshot()
+
+    def snapshot(self):
+        # Skip a round rather than queue up writes if the disk falls behind
+        if self.pending is not None and not self.pending.done():
+            return None
+        self.last_queries = self.dns_protection.total_queries
+        self.pending = self.executor.submit(_write_frozen, freeze(self.dns_protection), self.path)
+        return self.pending
+
+    def close(self):
+        self.executor.shutdown(wait=True)
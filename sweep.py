@@ -0,0 +1,127 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import nxd_detecter as nxd
+from attack_traces import load_data, synthetic_attack_dataset
+
+DEFAULTS = {'hierarchy_levels': 2, **nxd.PROTECTION_PARAMS, 'k': 10}
+
+RESULT_FIELDS = list(DEFAULTS) + ['tp', 'fp', 'tn', 'fn', 'packets_per_sec']
+
+# Trace views inside a worker process, attached once by _attach_trace
+_trace = {}
+
+
+def share_trace(sources, legitimate):
+    """
+    Copy the encoded trace into shared memory once. Workers map the same pages
+    read-only instead of receiving a pickled copy with every task.
+    """
+    blocks = []
+    spec = []
+    for array in (np.ascontiguousarray(sources, dtype=np.uint32), np.ascontiguousarray(legitimate, dtype=bool)):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        spec.append((block.name, array.shape, array.dtype.str))
+    return blocks, spec
+
+
+def _attach_trace(spec):
+    for key, (name, shape, dtype) in zip(('sources', 'legitimate'), spec):
+        block = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        _trace[key] = array
+        _trace[key + '_block'] = block  # keep the mapping alive
+
+
+def run_config(params, seed=0):
+    random.seed(seed)
+    start = time.perf_counter()
+    dns_protection, _ = nxd.simulate_attack_arrays(sources=_trace['sources'], legitimate=_trace['legitimate'], **params)
+    elapsed = time.perf_counter() - start
+    return dict(params, tp=dns_protection.tp, fp=dns_protection.fp, tn=dns_protection.tn, fn=dns_protection.fn,
+                packets_per_sec=len(_trace['sources']) / elapsed)
+
+
+def configurations(grid, samples=None, seed=0):
+    """Every combination of the grid, or `samples` random picks from it."""
+    names = list(grid)
+    if samples is None:
+        for values in itertools.product(*(grid[name] for name in names)):
+            yield dict(DEFAULTS, **dict(zip(names, values)))
+    else:
+        rng = random.Random(seed)
+        for _ in range(samples):
+            yield dict(DEFAULTS, **{name: rng.choice(grid[name]) for name in names})
+
+
+def sweep(sources, legitimate, configs, workers=None, seed=0):
+    """Run simulate_attack_arrays for every configuration on a process pool, yielding results as they finish."""
+    blocks, spec = share_trace(sources, legitimate)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_trace, initargs=(spec,)) as pool:
+            futures = [pool.submit(run_config, config, seed) for config in configs]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def parse_grid(entries):
+    grid = {}
+    for entry in entries:
+        name, values = entry.split('=', 1)
+        if name not in DEFAULTS:
+            raise ValueError(f"Unknown parameter '{name}', expected one of {', '.join(DEFAULTS)}")
+        cast = int if isinstance(DEFAULTS[name], int) else float
+        grid[name] = [cast(value) for value in values.split(',')]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parameter sweep over simulate_attack on a process pool')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='values to try for one simulate_attack parameter; repeat for a grid')
+    parser.add_argument('--samples', type=int, help='random search: number of configurations drawn from the grid')
+    parser.add_argument('--trace', help='CSV trace or columnar directory with a Legitimate column; default is a synthetic attack trace')
+    parser.add_argument('--packets', type=int, default=10000, help='legitimate packets in the synthetic trace')
+    parser.add_argument('--attack-volume', type=float, default=3.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='CSV file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    if args.trace:
+        dataset = load_data(args.trace)
+    else:
+        dataset = synthetic_attack_dataset(args.packets, args.attack_volume, seed=args.seed)
+    sources, legitimate = nxd.encode_trace(dataset)
+    configs = configurations(parse_grid(args.param), args.samples, args.seed)
+
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for result in sweep(sources, legitimate, configs, args.workers, args.seed):
+            writer.writerow(result)
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import random
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import nxd_detecter as nxd
+from hhh import SKETCHES
+from ip_utils import PrefixHierarchy
+from nxd_detecter import DNSProtection
+
+COUNTERS = ('tp', 'fp', 'tn', 'fn', 'total_queries', 'total_nxd')
+
+
+class Tenant:
+    # One destination: its own DNSProtection (trackers and attack state), the k
+    # it currently holds and the queries it has seen since the last rebalance
+    __slots__ = ('protection', 'k', 'load', 'last_seen')
+
+    def __init__(self, protection, k):
+        self.protection = protection
+        self.k = k
+        self.load = 0.0
+        self.last_seen = 0
+
+    def resize(self, k):
+        if k == self.k:
+            return
+        self.protection.rh_legit.resize(k)
+        self.protection.rh_attack.resize(k)
+        self.protection.table = None  # a decision table would list evicted prefixes
+        self.k = k
+
+
+class MultiTenantProtection:
+    """
+    One DNSProtection per destination (resolver), so a flood towards one
+    tenant cannot evict another tenant's prefixes or flip its attack state.
+    Tenants are created on their first query and share a global budget of
+    `counter_budget` Space-Saving counters: a tenant holding k costs
+    2 * hierarchy levels * k of them (the legit and attack trackers).
+
+    Every `rebalance_every` queries each tenant keeps min_k and the rest of
+    the budget is split in proportion to its recent load (queries since the
+    last rebalance plus `load_decay` times the load before). Tenants idle for
+    `idle_limit` queries are evicted, and when the budget cannot give one more
+    tenant min_k the least recently queried one is. The per-tenant
+    legit_traffic counters are not part of the budget, as in snapshots.
+    """
+    def __init__(self, counter_budget, min_k=4, rebalance_every=10000, idle_limit=100000, load_decay=0.5, **params):
+        for name in ('legit_sketch', 'attack_sketch'):
+            if not hasattr(SKETCHES[params.get(name, 'space_saving')], 'resize'):
+                raise ValueError(f"{name} must be a sketch whose k can be reallocated (space_saving)")
+        self.params = params
+        levels = len(PrefixHierarchy(params['hierarchy_levels'], params.get('family', 4)))
+        self.counters_per_k = 2 * levels
+        self.capacity = counter_budget // self.counters_per_k  # k summed over all tenants
+        if self.capacity < min_k:
+            raise ValueError(f"A budget of {counter_budget} counters cannot hold one tenant with k={min_k}")
+        self.counter_budget = counter_budget
+        self.min_k = min_k
+        self.rebalance_every = rebalance_every
+        self.idle_limit = idle_limit
+        self.load_decay = load_decay
+        self.tenants = OrderedDict()  # destination -> Tenant, least recently queried first
+        self.allocated = 0
+        self.queries = 0
+        self.created = 0
+        self.evicted = 0
+        self.retired = dict.fromkeys(COUNTERS, 0)  # counters of evicted tenants
+
+    def process_query(self, source, destination, nxd_flg):
+        tenant = self.tenants.get(destination)
+        if tenant is None:
+            tenant = self._admit(destination)
+        else:
+            self.tenants.move_to_end(destination)
+        self.queries += 1
+        tenant.load += 1
+        tenant.last_seen = self.queries
+        verdict = tenant.protection.process_query(source, nxd_flg)
+        if self.queries % self.rebalance_every == 0:
+            self.rebalance()
+        return verdict
+
+    def _admit(self, destination):
+        self._evict_idle()
+        while (len(self.tenants) + 1) * self.min_k > self.capacity:
+            self._evict(next(iter(self.tenants)))
+        free = self.capacity - self.allocated
+        # A fair share of what is free; when that is under min_k, take min_k and rebalance
+        k = max(min(free, self.capacity // (len(self.tenants) + 1)), self.min_k)
+        tenant = Tenant(DNSProtection(k=k, **self.params), k)
+        tenant.last_seen = self.queries
+        self.tenants[destination] = tenant
+        self.allocated += k
+        self.created += 1
+        if self.allocated > self.capacity:
+            self.rebalance()
+        return tenant
+
+    def _evict(self, destination):
+        tenant = self.tenants.pop(destination)
+        for name in COUNTERS:
+            self.retired[name] += getattr(tenant.protection, name)
+        self.allocated -= tenant.k
+        self.evicted += 1
+
+    def _evict_idle(self):
+        # Least recently queried first, so stop at the first tenant still active
+        while self.tenants:
+            destination, tenant = next(iter(self.tenants.items()))
+            if self.queries - tenant.last_seen < self.idle_limit:
+                break
+            self._evict(destination)
+
+    def rebalance(self):
+        """Evict idle tenants and split the budget: min_k each, the rest by recent load."""
+        self._evict_idle()
+        if not self.tenants:
+            return
+        tenants = list(self.tenants.values())
+        spare = self.capacity - self.min_k * len(tenants)
+        total_load = sum(tenant.load for tenant in tenants)
+        for tenant in tenants:
+            share = tenant.load / total_load if total_load else 1 / len(tenants)
+            tenant.resize(self.min_k + int(spare * share))
+            tenant.load *= self.load_decay
+        self.allocated = sum(tenant.k for tenant in tenants)
+
+    def counters_used(self):
+        """Counters held by the trackers right now; never above counter_budget."""
+        return sum(len(hh) for tenant in self.tenants.values()
+                   for tracker in (tenant.protection.rh_legit, tenant.protection.rh_attack)
+                   for hh in tracker.hh_algorithms)
+
+    def __getattr__(self, name):
+        # tp, fp, tn, fn, total_queries and total_nxd summed over live and evicted tenants
+        if name in COUNTERS:
+            return self.retired[name] + sum(getattr(tenant.protection, name) for tenant in self.tenants.values())
+        raise AttributeError(name)
+
+
+def simulate_tenants(dataset, counter_budget, seed=0, min_k=4, rebalance_every=10000, idle_limit=100000, **params):
+    """
+    Run a trace with a Destination column through MultiTenantProtection.
+    Returns the pool and the bool verdict array (True where allowed).
+    """
+    sources, legitimate = nxd.encode_trace(dataset)
+    destinations, _ = pd.factorize(dataset['Destination'])
+    random.seed(seed)
+    pool = MultiTenantProtection(counter_budget, min_k, rebalance_every, idle_limit, **params)
+    process_query = pool.process_query
+    verdicts = np.empty(len(sources), dtype=bool)
+    for i, (source, destination, nxd_flg) in enumerate(zip(sources.tolist(), destinations.tolist(), (~legitimate).tolist())):
+        verdicts[i] = process_query(source, destination, nxd_flg) == 'Allow'
+    return pool, verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare one shared DNSProtection with per-destination tenants')
+    parser.add_argument('--packets', type=int, default=10000, help='legitimate packets in the synthetic trace')
+    parser.add_argument('--attack-volume', type=float, default=3.0)
+    parser.add_argument('--counter-budget', type=int, default=8000, help='Space-Saving counters shared by all tenants')
+    parser.add_argument('--min-k', type=int, default=4)
+    parser.add_argument('--rebalance-every', type=int, default=5000)
+    parser.add_argument('--hierarchy-levels', type=int, default=2)
+    parser.add_argument('--single-target', action='store_true', help='send the whole flood to the busiest destination')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from attack_traces import synthetic_attack_dataset
+    dataset = synthetic_attack_dataset(args.packets, args.attack_volume, seed=args.seed)
+    sources, legitimate = nxd.encode_trace(dataset)
+    destinations = dataset['Destination'].astype(str).to_numpy()
+    target = pd.Series(destinations[legitimate]).value_counts().index[0]
+    if args.single_target:
+        destinations = np.where(legitimate, destinations, target)
+        dataset = dataset.assign(Destination=destinations)
+    params = dict(nxd.PROTECTION_PARAMS, hierarchy_levels=args.hierarchy_levels)
+
+    # The single instance gets the whole budget as one k
+    shared_k = args.counter_budget // (2 * len(PrefixHierarchy(args.hierarchy_levels)))
+    start = time.perf_counter()
+    random.seed(args.seed)
+    shared, shared_verdicts = nxd.simulate_attack_arrays(k=shared_k, sources=sources, legitimate=legitimate, **params)
+    shared_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    pool, verdicts = simulate_tenants(dataset, args.counter_budget, args.seed, args.min_k, args.rebalance_every, **params)
+    pool_elapsed = time.perf_counter() - start
+
+    print(f"{len(dataset)} packets to {len(np.unique(destinations))} destinations, budget {args.counter_budget} counters"
+          + (f", flood aimed at {target}" if args.single_target else ""))
+    others = destinations != target
+    for label, protection, allowed, elapsed in (('shared', shared, shared_verdicts, shared_elapsed),
+                                                ('tenants', pool, verdicts, pool_elapsed)):
+        print(f"{label:>8}  TP={protection.tp} FP={protection.fp} TN={protection.tn} FN={protection.fn}  "
+              f"legit blocked: {int((~allowed & legitimate & ~others).sum())} at {target}, "
+              f"{int((~allowed & legitimate & others).sum())} elsewhere  {len(dataset) / elapsed:.0f} pkt/s")
+    print(f"tenants: {len(pool.tenants)} live, {pool.created} created, {pool.evicted} evicted, "
+          f"{pool.counters_used()} counters in use")
+
+
+if __name__ == "__main__":
+    main()
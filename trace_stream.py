@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ip_utils import DOTTED_QUAD, encode_ips
+from nxd_detecter import DNSProtection
+
+
+def iter_trace_chunks(file_path, chunksize=1_000_000):
+    """
+    Read a DNS trace CSV in bounded-memory chunks and yield (sources, legitimate)
+    arrays per chunk. Only the Source and, if present, Legitimate columns are
+    parsed; rows without a Legitimate column count as legitimate traffic.
+    """
+    reader = pd.read_csv(file_path, chunksize=chunksize, usecols=lambda column: column in ('Source', 'Legitimate'))
+    for chunk in reader:
+        # Drop non-IP sources like save_samples does (and anything else that is not a dotted quad of 0-255 octets)
+        condition = chunk['Source'].str.contains('[a-zA-Z]', case=True, na=True)
+        chunk = chunk[~condition & chunk['Source'].str.fullmatch(DOTTED_QUAD, na=False)]
+        if 'Legitimate' in chunk:
+            legitimate = chunk['Legitimate']
+            legitimate = ~((legitimate == False) | (legitimate.astype(str) == 'False')).to_numpy(dtype=bool)
+        else:
+            legitimate = np.ones(len(chunk), dtype=bool)
+        yield encode_ips(chunk['Source']), legitimate
+
+
+def ingest_trace(file_path, dns_protection, chunksize=1_000_000, per_packet=False):
+    """
+    Stream a trace into dns_protection chunk by chunk. By default chunks go
+    through process_batch (warm-up / replay); per_packet runs the blocking path
+    and keeps the TP/FP/TN/FN counters. Returns the number of packets ingested.
+    """
+    packets = 0
+    for sources, legitimate in iter_trace_chunks(file_path, chunksize):
+        if per_packet:
+            process_query = dns_protection.process_query
+            for source, legit in zip(sources.tolist(), legitimate.tolist()):
+                process_query(source, not legit)
+        else:
+            dns_protection.process_batch(sources, legitimate)
+        packets += len(sources)
+    return packets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream a DNS trace CSV into DNSProtection in bounded memory')
+    parser.add_argument('file_path')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--per-packet', action='store_true', help='run the blocking path instead of batch ingestion')
+    parser.add_argument('--hierarchy-levels', type=int, default=2)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--upper-threshold-nxd-ratio', type=float, default=0.1)
+    parser.add_argument('--lower-threshold-nxd-ratio', type=float, default=0.05)
+    parser.add_argument('--upper-attack-threshold-ratio', type=float, default=0.6)
+    parser.add_argument('--lower-attack-threshold-ratio', type=float, default=0.3)
+    parser.add_argument('--list-expiry-limit', type=int, default=150)
+    parser.add_argument('--aging', type=float, default=0.5)
+    args = parser.parse_args()
+
+    dns_protection = DNSProtection(
+        upper_threshold_nxd_ratio=args.upper_threshold_nxd_ratio,
+        lower_threshold_nxd_ratio=args.lower_threshold_nxd_ratio,
+        upper_attack_threshold_ratio=args.upper_attack_threshold_ratio,
+        lower_attack_threshold_ratio=args.lower_attack_threshold_ratio,
+        hierarchy_levels=args.hierarchy_levels,
+        aging=args.aging,
+        k=args.k,
+        list_expiry_limit=args.list_expiry_limit
+    )
+    start = time.perf_counter()
+    packets = ingest_trace(args.file_path, dns_protection, args.chunksize, args.per_packet)
+    elapsed = time.perf_counter() - start
+
+    print(f"{packets} packets in {elapsed:.2f}s ({packets / elapsed:.0f} packets/s)")
+    print(f"NXD: {dns_protection.total_nxd}, under attack: {dns_protection.under_attack}")
+    if args.per_packet:
+        print(f"TP={dns_protection.tp} FP={dns_protection.fp} TN={dns_protection.tn} FN={dns_protection.fn}")
+
+
+if __name__ == "__main__":
+    main()
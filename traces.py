@@ -1,20 +1,23 @@
 import random
+import numpy as np
 import pandas as pd
 
 def save_samples():
-    # Load the large dataset
+    # Read the large dataset in chunks so memory stays bounded
     file_path = 'dns_traces.csv'
-    large_dataset = pd.read_csv(file_path)
-
-    # Condition to drop rows where 'Length' > 1000
-    condition = large_dataset['Source'].str.contains('[a-zA-Z]', case=True, na=False)
-
-    # Drop rows that meet the condition
-    cleaned_dataset = large_dataset[~condition]
-
-
-    # Randomly sample 1% of the data (adjust the fraction as needed)
-    sampled_dataset = cleaned_dataset.sample(frac=0.01, random_state=42)
+    samples = []
+    # One generator for every chunk, so chunks do not all sample the same row offsets
+    rng = np.random.default_rng(42)
+    for chunk in pd.read_csv(file_path, chunksize=1_000_000):
+        # Condition to drop rows where 'Length' > 1000
+        condition = chunk['Source'].str.contains('[a-zA-Z]', case=True, na=False)
+
+        # Drop rows that meet the condition
+        cleaned_chunk = chunk[~condition]
+
+        # Randomly sample 1% of the data (adjust the fraction as needed)
+        samples.append(cleaned_chunk.sample(frac=0.01, random_state=rng))
+    sampled_dataset = pd.concat(samples)
 
     # Sort the sampled dataset by a specific column, e.g., 'Time'
     sorted_sampled_dataset = sampled_dataset.sort_values(by='Time')